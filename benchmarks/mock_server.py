@@ -0,0 +1,366 @@
+import json
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlencode, urlsplit
+
+from pynamics365.partition import guid_to_key, key_to_guid
+
+API_PATH = "/api/data/v9.2"
+TOKEN_PATH = "/oauth2/token"
+MAX_PAGE_SIZE = 5000
+FORMATTED_VALUE = "OData.Community.Display.V1.FormattedValue"
+LOOKUP_LOGICAL_NAME = "Microsoft.Dynamics.CRM.lookuplogicalname"
+NAVIGATION_PROPERTY = "Microsoft.Dynamics.CRM.associatednavigationproperty"
+COLUMN_TYPES = ["String", "Integer", "Money", "DateTime", "Picklist", "Lookup", "Boolean", "Decimal", "Memo"]
+POOL_SIZE = 64
+KEY_STEP = 2 ** 100
+GUID_CLAUSE = re.compile(r"(\w+) (ge|gt|le|lt|eq) ([0-9a-fA-F-]{36})")
+
+
+def _label(label):
+    return {"UserLocalizedLabel": {"Label": label}, "LocalizedLabels": [{"Label": label, "LanguageCode": 1033}]}
+
+
+def _prefer(header):
+    """Return `(maxpagesize, annotations)` from a Prefer header. Annotations is "*", a set of names or None."""
+    page_size, annotations = MAX_PAGE_SIZE, None
+    for preference in re.findall(r'[\w.-]+(?:="[^"]*"|=[^,]*)?', header or ""):
+        name, _, value = preference.partition("=")
+        if name == "odata.maxpagesize" and value.isdigit():
+            page_size = min(int(value), MAX_PAGE_SIZE)
+        elif name == "odata.include-annotations":
+            value = value.strip('"')
+            annotations = "*" if value == "*" else set(value.split(","))
+    return page_size, annotations
+
+
+class MockEntity:
+    """A synthetic table of `records` rows and `columns` columns, generated from its row index.
+
+    Primary keys are random within evenly spaced slots, so SQL Server
+    uniqueidentifier order is row order and key-range `$filter`s map
+    straight to row ranges.
+    Column values cycle through small pools, so pages cost little to build.
+    """
+
+    def __init__(self, logical_name, records, columns=50, object_type_code=10000, seed=0):
+        self.logical_name = logical_name
+        self.entity_set = f"{logical_name}s"
+        self.primary_key = f"{logical_name}id"
+        self.records = records
+        self.object_type_code = object_type_code
+        self.metadata_id = key_to_guid(object_type_code + 1)
+        rng = random.Random(f"{seed}-{logical_name}")
+        self.columns = [(f"new_column{i}", COLUMN_TYPES[i % len(COLUMN_TYPES)]) for i in range(columns)]
+        self.pools = [self._pool(rng, attribute_type) for _, attribute_type in self.columns]
+        self.keys = [KEY_STEP * (i + 1) + rng.getrandbits(96) for i in range(records)]
+
+    @staticmethod
+    def _pool(rng, attribute_type):
+        values = []
+        for _ in range(POOL_SIZE):
+            if attribute_type in ("String", "Memo"):
+                text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(8, 60)))
+                values.append((text, None))
+            elif attribute_type in ("Integer", "Picklist"):
+                number = rng.randint(100000000, 100000020) if attribute_type == "Picklist" else rng.randint(0, 10 ** 6)
+                values.append((number, f"Option {number % 100}" if attribute_type == "Picklist" else f"{number:,}"))
+            elif attribute_type in ("Money", "Decimal"):
+                amount = round(rng.uniform(0, 10 ** 6), 2)
+                values.append((amount, f"${amount:,.2f}"))
+            elif attribute_type == "DateTime":
+                stamp = time.gmtime(rng.randint(1_500_000_000, 1_700_000_000))
+                values.append((time.strftime("%Y-%m-%dT%H:%M:%SZ", stamp), time.strftime("%d/%m/%Y %I:%M %p", stamp)))
+            elif attribute_type == "Lookup":
+                values.append((key_to_guid(rng.getrandbits(128)), f"Related record {rng.randint(1, 500)}"))
+            elif attribute_type == "Boolean":
+                flag = rng.random() < 0.5
+                values.append((flag, "Yes" if flag else "No"))
+        return values
+
+    @staticmethod
+    def column_name(logical_name, attribute_type):
+        return f"_{logical_name}_value" if attribute_type == "Lookup" else logical_name
+
+    def definition(self):
+        return {
+            "MetadataId": self.metadata_id,
+            "LogicalName": self.logical_name,
+            "SchemaName": self.logical_name,
+            "EntitySetName": self.entity_set,
+            "LogicalCollectionName": self.entity_set,
+            "CollectionName": self.entity_set,
+            "PrimaryIdAttribute": self.primary_key,
+            "PrimaryNameAttribute": "new_column0",
+            "ObjectTypeCode": self.object_type_code,
+            "ChangeTrackingEnabled": False,
+            "IsPrivate": False,
+            "IsLogicalEntity": False,
+            "TableType": "Standard",
+            "DisplayName": _label(self.logical_name.title()),
+            "DisplayCollectionName": _label(f"{self.logical_name.title()}s"),
+            "Description": _label(f"Synthetic {self.logical_name} table"),
+        }
+
+    def attributes(self):
+        attributes = [{"LogicalName": self.primary_key, "AttributeType": "Uniqueidentifier", "AttributeOf": None,
+                       "IsValidForRead": True, "AttributeTypeName": {"Value": "UniqueidentifierType"}}]
+        for logical_name, attribute_type in self.columns:
+            attributes.append({"LogicalName": logical_name, "AttributeType": attribute_type, "AttributeOf": None,
+                               "IsValidForRead": True, "AttributeTypeName": {"Value": f"{attribute_type}Type"}})
+        return attributes
+
+    def record(self, index, select=None, annotations=None):
+        record = {"@odata.etag": f'W/"{index + 1000}"'}
+        primary_key = key_to_guid(self.keys[index])
+        if select is None or self.primary_key in select:
+            record[self.primary_key] = primary_key
+        for position, ((logical_name, attribute_type), pool) in enumerate(zip(self.columns, self.pools)):
+            column = self.column_name(logical_name, attribute_type)
+            if select is not None and column not in select:
+                continue
+            value, label = pool[(index * 31 + position) % POOL_SIZE]
+            if annotations and label is not None:
+                if annotations == "*" or FORMATTED_VALUE in annotations:
+                    record[f"{column}@{FORMATTED_VALUE}"] = label
+                if attribute_type == "Lookup":
+                    if annotations == "*" or LOOKUP_LOGICAL_NAME in annotations:
+                        record[f"{column}@{LOOKUP_LOGICAL_NAME}"] = "account"
+                    if annotations == "*" or NAVIGATION_PROPERTY in annotations:
+                        record[f"{column}@{NAVIGATION_PROPERTY}"] = f"{logical_name}_account"
+            record[column] = value
+        return record
+
+    def row_range(self, filter_clause):
+        """Translate the primary key clauses of a `$filter` into a `[start, stop)` range of rows."""
+        start, stop = 0, self.records
+        for column, operator, guid in GUID_CLAUSE.findall(filter_clause or ""):
+            if column != self.primary_key:
+                continue
+            position = bisect_left(self.keys, guid_to_key(guid))
+            exact = position < self.records and self.keys[position] == guid_to_key(guid)
+            if operator == "ge":
+                start = max(start, position)
+            elif operator == "gt":
+                start = max(start, position + exact)
+            elif operator == "lt":
+                stop = min(stop, position)
+            elif operator == "le":
+                stop = min(stop, position + exact)
+            elif operator == "eq":
+                start, stop = max(start, position), min(stop, position + exact)
+        return start, max(start, stop)
+
+
+class MockDataverse:
+    """A local Dataverse Web API on a background thread, for running extractions offline.
+
+    Serves a token endpoint, the service document, EntityDefinitions and
+    their Attributes, RetrieveTotalRecordCount, recordcountsnapshots and
+    paged entity sets with `@odata.nextLink`. `$select`, primary key
+    `$filter` ranges, `$orderby` direction, `$top` and the Prefer
+    maxpagesize and include-annotations preferences are honoured.
+
+    Every API request waits `latency` seconds plus `latency_per_record` per
+    record returned. A `throttle_rate` share of requests gets a 429 with
+    Retry-After, and an `unavailable_rate` share gets a 503. Counters for
+    what was served are kept in `stats`.
+    """
+
+    def __init__(self, entities=None, columns=50, latency=0.0, latency_per_record=0.0, throttle_rate=0.0,
+                 unavailable_rate=0.0, retry_after=1, host="127.0.0.1", port=0, seed=0):
+        entities = entities or {"new_benchmark": 10000}
+        self.entities = {}
+        for offset, (logical_name, records) in enumerate(entities.items()):
+            entity = MockEntity(logical_name, records, columns, object_type_code=10000 + offset, seed=seed)
+            self.entities[entity.entity_set] = entity
+        self.latency = latency
+        self.latency_per_record = latency_per_record
+        self.throttle_rate = throttle_rate
+        self.unavailable_rate = unavailable_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}{API_PATH}"
+
+    @property
+    def auth_url(self):
+        return f"{self.url}{TOKEN_PATH}"
+
+    def client_kwargs(self):
+        """Keyword arguments that point a DynamicsClient at this server."""
+        return {"auth_url": self.auth_url, "resource": self.url, "base_url": self.base_url,
+                "client_id": "benchmark", "username": "benchmark", "password": "benchmark"}
+
+    def entity(self, logical_name):
+        return self.entities[f"{logical_name}s"]
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "pages": 0, "records": 0, "bytes": 0, "throttled": 0, "unavailable": 0}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                self.stats[name] += count
+
+    def _fault(self):
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.unavailable_rate:
+            return 503
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-dataverse", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if urlsplit(self.path).path != TOKEN_PATH:
+                    return self.send_json(404, error_body("0x80060888", "Resource not found"))
+                self.send_json(200, {"token_type": "Bearer", "access_token": "mock-token",
+                                     "expires_in": "3600", "expires_on": str(int(time.time()) + 3600)})
+
+            def do_GET(self):
+                parts = urlsplit(self.path)
+                path = unquote(parts.path)
+                if not path.startswith(API_PATH):
+                    return self.send_json(404, error_body("0x80060888", "Resource not found"))
+                mock._count(requests=1)
+                fault = mock._fault()
+                if fault == 429:
+                    mock._count(throttled=1)
+                    return self.send_json(429, error_body("0x80072322", "Number of requests exceeded the limit"),
+                                          {"Retry-After": str(mock.retry_after)})
+                if fault == 503:
+                    mock._count(unavailable=1)
+                    return self.send_json(503, error_body("0x80040216", "Service unavailable"))
+                status, body, records, headers = mock.route(path[len(API_PATH):].strip("/"),
+                                                            dict(parse_qsl(parts.query, keep_blank_values=True)),
+                                                            self.headers.get("Prefer"))
+                delay = mock.latency + mock.latency_per_record * (records or 0)
+                if delay:
+                    time.sleep(delay)
+                size = self.send_json(status, body, headers)
+                if records is not None and status == 200:
+                    mock._count(pages=1, records=records, bytes=size)
+
+            def send_json(self, status, body, headers=None):
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; odata.metadata=minimal")
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("OData-Version", "4.0")
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+                return len(payload)
+
+        return Handler
+
+    def route(self, path, query, prefer):
+        """Return `(status, body, records, headers)`. `records` is None for anything but an entity set page."""
+        context = {"@odata.context": f"{self.base_url}/$metadata"}
+        if path == "":
+            sets = [{"name": e.entity_set, "kind": "EntitySet", "url": e.entity_set} for e in self.entities.values()]
+            return 200, {**context, "value": sets}, None, {}
+        if path == "EntityDefinitions":
+            return 200, {**context, "value": [e.definition() for e in self.entities.values()]}, None, {}
+        match = re.fullmatch(r"EntityDefinitions\(LogicalName='(\w+)'\)(/Attributes)?", path)
+        if match:
+            entity = self.entities.get(f"{match.group(1)}s")
+            if entity is None:
+                return 404, error_body("0x80060888", f"Could not find entity {match.group(1)}"), None, {}
+            if match.group(2):
+                return 200, {**context, "value": entity.attributes()}, None, {}
+            return 200, {**context, **entity.definition()}, None, {}
+        if path.startswith("RetrieveTotalRecordCount"):
+            names = json.loads(query.get("@names") or "[]")
+            by_name = {e.logical_name: e for e in self.entities.values()}
+            missing = [name for name in names if name not in by_name]
+            if missing:
+                return 400, error_body("0x80040217", f"Entity {missing[0]} does not support record counts"), None, {}
+            collection = {"Keys": names, "Values": [by_name[name].records for name in names]}
+            return 200, {**context, "EntityRecordCountCollection": collection}, None, {}
+        if path == "recordcountsnapshots":
+            snapshots = [{"objecttypecode": e.object_type_code, "count": e.records,
+                          "lastupdated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+                         for e in self.entities.values()]
+            return 200, {**context, "value": snapshots}, None, {}
+        entity = self.entities.get(path)
+        if entity is None:
+            return 404, error_body("0x80060888", f"Resource not found for the segment '{path}'"), None, {}
+        return self.page(entity, query, prefer)
+
+    def page(self, entity, query, prefer):
+        page_size, annotations = _prefer(prefer)
+        start, stop = entity.row_range(query.get("$filter"))
+        descending = query.get("$orderby", "").endswith(" desc")
+        top = int(query["$top"]) if query.get("$top") else None
+        if top is not None:
+            stop = min(stop, start + top) if not descending else stop
+            start = max(start, stop - top) if descending else start
+        skip = int(query.get("$skiptoken") or 0)
+        rows = range(start + skip, min(stop, start + skip + page_size))
+        if descending:
+            rows = range(stop - 1 - skip, max(start, stop - skip - page_size) - 1, -1)
+        select = set(query["$select"].split(",")) if query.get("$select") else None
+        body = {"@odata.context": f"{self.base_url}/$metadata#{entity.entity_set}",
+                "value": [entity.record(index, select, annotations) for index in rows]}
+        if skip + page_size < stop - start:
+            next_query = {name: value for name, value in query.items() if name != "$skiptoken"}
+            next_query["$skiptoken"] = str(skip + page_size)
+            body["@odata.nextLink"] = f"{self.base_url}/{entity.entity_set}?{urlencode(next_query, quote_via=quote)}"
+        applied = [f"odata.maxpagesize={page_size}"]
+        if annotations:
+            applied.append(f'odata.include-annotations="{"*" if annotations == "*" else ",".join(sorted(annotations))}"')
+        return 200, body, len(body["value"]), {"Preference-Applied": ",".join(applied)}
+
+
+def error_body(code, message):
+    return {"error": {"code": code, "message": message}}
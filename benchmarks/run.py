@@ -0,0 +1,213 @@
+"""Extraction benchmarks against a local mock Dataverse Web API.
+
+    python -m benchmarks.run --records 20000 --columns 100 --latency 0.02
+    python -m benchmarks.run --modes pages lean async --json results.json
+    python -m benchmarks.run --compare results.json --tolerance 0.15
+
+Each mode runs in a fresh process, so peak RSS is that mode's alone.
+Pages/s, records/s and bytes/s are over the extraction only, not client
+setup. Bytes are what the server sent for entity set pages. Page latency
+is the time between pages as the caller sees them, so it includes parsing.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.mock_server import MockDataverse
+
+MODES = ["pages", "lean", "stream", "async", "partitioned", "records", "compact", "json"]
+LOGICAL_NAME = "new_benchmark"
+HIGHER_IS_WORSE = {"peak_rss_mb", "p50_page_ms", "p99_page_ms"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class PageTimer:
+    """Record the gap before each page reaches the caller."""
+
+    def __init__(self):
+        self.latencies = []
+        self.last = time.perf_counter()
+
+    def tick(self):
+        now = time.perf_counter()
+        self.latencies.append(now - self.last)
+        self.last = now
+
+
+def _consume(mode, dc, settings, work_dir):
+    """Run one extraction mode and return `(pages, records, page_latencies)`, with None for counts it cannot see."""
+    endpoint, primary_key = settings["endpoint"], settings["primary_key"]
+    timer = PageTimer()
+    pages = records = 0
+    if mode in ("pages", "lean"):
+        for page in dc.iter_pages(endpoint, lean=mode == "lean"):
+            timer.tick()
+            pages += 1
+            records += len(page['value'])
+    elif mode == "stream":
+        for _ in dc.iter_records(endpoint, stream=True):
+            records += 1
+        return None, records, []
+    elif mode == "async":
+        async def consume():
+            count = [0, 0]
+            async with dc.aclient as client:
+                async for page in client.iter_pages(endpoint):
+                    timer.tick()
+                    count[0] += 1
+                    count[1] += len(page['value'])
+            return count
+
+        pages, records = asyncio.run(consume())
+    elif mode == "partitioned":
+        for _, page in dc.iter_partitioned_pages(endpoint, primary_key, settings["partitions"]):
+            timer.tick()
+            pages += 1
+            records += len(page['value'])
+    elif mode in ("records", "compact"):
+        records = len(dc.get_all_records(endpoint, compact=mode == "compact"))
+        return None, records, []
+    elif mode == "json":
+        from pynamics365.entity import DynamicsEntityExtractor
+        extractor = DynamicsEntityExtractor(dc, retain=False, **dc.get_entity_list()[LOGICAL_NAME])
+        extractor.headers["Prefer"] = dc.headers["Prefer"]
+        return extractor.save_all_pages_to_json(work_dir / "output"), None, []
+    else:
+        raise ValueError(f"Unknown mode {mode}")
+    return pages, records, timer.latencies
+
+
+def run_mode(mode, settings):
+    """Run `mode` in this process against the server in `settings` and return its client-side measurements."""
+    from pynamics365.main import DynamicsClient
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        dc = DynamicsClient(**settings["client"], token_path=work_dir / "token.json",
+                            metadata_path=work_dir / "metadata.sqlite", cache_path=work_dir / "cache.sqlite")
+        dc.headers["Prefer"] = f'odata.include-annotations="*",odata.maxpagesize={settings["page_size"]}'
+        dc.get_attributes(LOGICAL_NAME)
+        started = time.perf_counter()
+        pages, records, latencies = _consume(mode, dc, settings, work_dir)
+        elapsed = time.perf_counter() - started
+    return {"pages": pages, "records": records, "seconds": elapsed, "latencies": latencies,
+            "peak_rss_mb": peak_rss_mb()}
+
+
+def measure(server, mode, settings):
+    """Run `mode` in a fresh spawned process and combine its numbers with what the server served."""
+    server.reset_stats()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        result = pool.apply(run_mode, (mode, settings))
+    served = server.snapshot()
+    seconds = result["seconds"] or float("nan")
+    pages = result["pages"] if result["pages"] is not None else served["pages"]
+    records = result["records"] if result["records"] is not None else served["records"]
+    p50, p99 = percentile(result["latencies"], 0.5), percentile(result["latencies"], 0.99)
+    return {
+        "mode": mode,
+        "seconds": round(seconds, 3),
+        "pages": pages,
+        "records": records,
+        "pages_per_second": round(pages / seconds, 2),
+        "records_per_second": round(records / seconds, 1),
+        "bytes_per_second": round(served["bytes"] / seconds),
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "p50_page_ms": round(p50 * 1000, 2) if p50 is not None else None,
+        "p99_page_ms": round(p99 * 1000, 2) if p99 is not None else None,
+        "throttled": served["throttled"],
+        "unavailable": served["unavailable"],
+    }
+
+
+def format_table(results):
+    columns = ["mode", "seconds", "pages", "records", "pages_per_second", "records_per_second", "bytes_per_second",
+               "peak_rss_mb", "p50_page_ms", "p99_page_ms", "throttled", "unavailable"]
+    rows = [[str("-" if result[c] is None else result[c]) for c in columns] for result in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    lines = ["  ".join(c.ljust(w) for c, w in zip(columns, widths)).rstrip()]
+    lines += ["  ".join(value.ljust(w) for value, w in zip(row, widths)).rstrip() for row in rows]
+    return "\n".join(lines)
+
+
+def regressions(results, baseline, tolerance):
+    """Compare against an earlier `--json` file. Rates may not drop, nor RSS and latency rise, by more than tolerance."""
+    previous = {result["mode"]: result for result in baseline["results"]}
+    found = []
+    for result in results:
+        before = previous.get(result["mode"])
+        if not before:
+            continue
+        for metric in ("records_per_second", "bytes_per_second", "peak_rss_mb", "p99_page_ms"):
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change > tolerance) if metric in HIGHER_IS_WORSE else (change < -tolerance):
+                found.append(f"{result['mode']} {metric}: {old} -> {new} ({change:+.0%})")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="benchmarks.run", description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="*", default=MODES, choices=MODES)
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--columns", type=int, default=50, help="record width, before annotations")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--partitions", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--latency-per-record", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--unavailable-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with each 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="a previous --json file to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    server = MockDataverse({LOGICAL_NAME: args.records}, columns=args.columns, latency=args.latency,
+                           latency_per_record=args.latency_per_record, throttle_rate=args.throttle_rate,
+                           unavailable_rate=args.unavailable_rate, retry_after=args.retry_after, seed=args.seed)
+    entity = server.entity(LOGICAL_NAME)
+    settings = {"client": server.client_kwargs(), "endpoint": entity.entity_set, "primary_key": entity.primary_key,
+                "page_size": args.page_size, "partitions": args.partitions}
+    results = []
+    with server:
+        for mode in args.modes:
+            results.append(measure(server, mode, settings))
+            print(f"{mode}: {results[-1]['records']} records in {results[-1]['seconds']}s", file=sys.stderr)
+    print(format_table(results))
+
+    if args.json:
+        config = {k: v for k, v in vars(args).items() if k not in ("json", "compare", "tolerance", "modes")}
+        with open(args.json, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
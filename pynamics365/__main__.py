@@ -0,0 +1,38 @@
+import argparse
+import json
+
+from pynamics365.manifest import Manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pynamics365", description="Sharded extraction from a shared manifest.")
+    parser.add_argument("--manifest", default="../data/.manifest.sqlite")
+    parser.add_argument("--lease", type=int, default=300, help="lease length in seconds")
+    commands = parser.add_subparsers(dest="command", required=True)
+    plan_parser = commands.add_parser("plan", help="add a unit per entity or entity partition")
+    plan_parser.add_argument("entities", nargs="*", help="logical names, default all")
+    plan_parser.add_argument("--partition-pages", type=int, default=500)
+    work_parser = commands.add_parser("work", help="claim and extract units until none are left")
+    work_parser.add_argument("--processes", type=int, default=None)
+    work_parser.add_argument("--output", default="../data")
+    commands.add_parser("status", help="show unit counts by status")
+    commands.add_parser("reclaim", help="release units whose lease has expired")
+    args = parser.parse_args(argv)
+
+    if args.command == "plan":
+        from pynamics365.main import DynamicsClient
+        from pynamics365.shard import plan
+        manifest = Manifest(args.manifest, args.lease)
+        print(f"Planned {plan(DynamicsClient(), manifest, args.entities, args.partition_pages)} units")
+    elif args.command == "work":
+        from pynamics365.shard import run_pool
+        completed = run_pool(args.manifest, args.processes, args.output, args.lease)
+        print(f"Completed {sum(completed)} units")
+    elif args.command == "status":
+        print(json.dumps(Manifest(args.manifest, args.lease).summary(), indent=2))
+    elif args.command == "reclaim":
+        print(f"Reclaimed {Manifest(args.manifest, args.lease).reclaim()} units")
+
+
+if __name__ == '__main__':
+    main()
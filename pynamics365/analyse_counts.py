@@ -1,13 +1,11 @@
-import json
 import pandas as pd
-import client
 
-environment_json = json.loads(open('.environment.json').read())
+from pynamics365.main import DynamicsClient
 
-dc = client.DynamicsClient()
-entities = dc.entities
+dc = DynamicsClient()
+entities = dc.get_entity_list()
 
-counts = environment_json['https://org30a87.crm5.dynamics.com/api/data/v9.2']['record_counts']
+counts = dc.record_counts or dc.get_record_counts()
 entity_counts = []
 for entity, count in counts.items():
     try:
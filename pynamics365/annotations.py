@@ -0,0 +1,112 @@
+import json
+import threading
+from pathlib import Path
+
+FORMATTED_VALUE = "OData.Community.Display.V1.FormattedValue"
+LOOKUP_LOGICAL_NAME = "Microsoft.Dynamics.CRM.lookuplogicalname"
+NAVIGATION_PROPERTY = "Microsoft.Dynamics.CRM.associatednavigationproperty"
+
+
+def split_key(key):
+    """Split `column@Namespace.Term` into `(column, "Namespace.Term")`, or return `(key, None)` for plain keys.
+
+    Record-level annotations such as `@odata.etag` start with "@" and are
+    not field annotations, so they are returned whole.
+    """
+    column, separator, annotation = key.partition("@")
+    if not separator or not column:
+        return key, None
+    return column, annotation
+
+
+class AnnotationSplitter:
+    """Move per-field annotations out of records into shared dictionaries keyed by the raw value.
+
+    With `odata.include-annotations="*"` every row repeats the same labels:
+    a status's formatted value, a lookup's target table and display name.
+    The splitter keeps one entry per distinct `(column, annotation, value)`
+    and strips the annotation keys from the record. Once a dictionary holds
+    `max_entries`, as formatted dates or high-cardinality lookups can, the
+    entries collected so far are kept but that annotation is left inline in
+    the records instead of being stripped, since labels such as a lookup's
+    display name cannot be derived from the raw value. Annotations on list
+    or object values are always left inline. One splitter may be shared by
+    threads extracting partitions of the same entity.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.tables = {}
+        self.inline = set()
+        self._lock = threading.RLock()
+
+    def split_record(self, record):
+        with self._lock:
+            stripped = set()
+            for key, label in record.items():
+                column, annotation = split_key(key)
+                if annotation is None or self._keep_inline(column, annotation, record.get(column), label):
+                    continue
+                stripped.add(key)
+            return {key: value for key, value in record.items() if key not in stripped}
+
+    def _keep_inline(self, column, annotation, raw, label):
+        if (column, annotation) in self.inline or isinstance(raw, (list, dict)):
+            return True
+        table = self.tables.setdefault(column, {}).setdefault(annotation, {})
+        if raw in table:
+            return False
+        if len(table) >= self.max_entries:
+            self.inline.add((column, annotation))
+            return True
+        table[raw] = label
+        return False
+
+    def split_page(self, page):
+        with self._lock:
+            return {**page, "value": [self.split_record(record) for record in page['value']]}
+
+    def label(self, column, value, annotation=FORMATTED_VALUE):
+        return self.tables.get(column, {}).get(annotation, {}).get(value)
+
+    def join(self, record, annotations=(FORMATTED_VALUE,)):
+        """Return a copy of `record` with the recorded annotations added back as `column@annotation` keys."""
+        joined = dict(record)
+        for column, tables in self.tables.items():
+            if column not in record:
+                continue
+            for annotation in annotations:
+                label = tables.get(annotation, {}).get(record[column])
+                if label is not None:
+                    joined.setdefault(f"{column}@{annotation}", label)
+        return joined
+
+    def to_dict(self):
+        with self._lock:
+            return {column: {annotation: [[raw, label] for raw, label in table.items()]
+                             for annotation, table in tables.items()}
+                    for column, tables in self.tables.items()}
+
+    def save(self, path):
+        """Write the dictionaries as JSON. Raw values are kept in pairs, since they are not all strings.
+
+        The file is written beside `path` and then moved into place, one
+        save at a time, so partitions saving concurrently never interleave.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            partial = path.with_name(f"{path.name}.partial")
+            with open(partial, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+            partial.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        splitter = cls(**kwargs)
+        with open(path) as f:
+            for column, tables in json.load(f).items():
+                splitter.tables[column] = {annotation: {raw: label for raw, label in pairs}
+                                           for annotation, pairs in tables.items()}
+        return splitter
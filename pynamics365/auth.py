@@ -1,34 +1,130 @@
+import asyncio
 import json
 import os
+import threading
 from datetime import datetime
 import time
 import requests
 from dotenv import load_dotenv
 
 
+class TokenManager:
+    """Single-flight bearer token cache shared by every client of one identity.
+
+    Callers get the cached token without locking while it is fresh. Within
+    `refresh_margin` seconds of expiry, the first caller refreshes and the
+    others keep using the still-valid token. If that early refresh fails,
+    the valid token is still returned and the next attempt waits
+    `retry_interval` seconds. Once it has expired, callers wait on the one
+    refresh in progress. The (token, expires_on) pair is
+    swapped as a single tuple, so a reader never sees half an update.
+    """
+    _managers = {}
+    _registry_lock = threading.Lock()
+
+    def __init__(self, fetch, refresh_margin=300, retry_interval=30):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.last_refresh = None
+        self._retry_at = 0
+        self._lock = threading.Lock()
+        self._state = (None, 0)
+
+    @classmethod
+    def shared(cls, key, fetch, refresh_margin=300, retry_interval=30):
+        with cls._registry_lock:
+            if key not in cls._managers:
+                cls._managers[key] = cls(fetch, refresh_margin, retry_interval)
+            return cls._managers[key]
+
+    @property
+    def expires_on(self):
+        return self._state[1]
+
+    def seed(self, token, expires_on):
+        if token and int(expires_on) > self._state[1]:
+            self._state = (token, int(expires_on))
+
+    def _refresh(self):
+        token = self.fetch()
+        self._state = (token['access_token'], int(token['expires_on']))
+        self.last_refresh = int(time.time())
+
+    def token(self):
+        token, expires_on = self._state
+        now = time.time()
+        if token and now < expires_on - self.refresh_margin:
+            return token
+        if token and now < expires_on:
+            if now >= self._retry_at and self._lock.acquire(blocking=False):
+                try:
+                    if self._state[0] == token:
+                        self._refresh()
+                except Exception:
+                    self._retry_at = now + self.retry_interval
+                finally:
+                    self._lock.release()
+            return self._state[0]
+        with self._lock:
+            token, expires_on = self._state
+            if not token or time.time() >= expires_on:
+                self._refresh()
+            return self._state[0]
+
+    async def atoken(self):
+        token, expires_on = self._state
+        if token and time.time() < expires_on - self.refresh_margin:
+            return token
+        return await asyncio.to_thread(self.token)
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+            return self._state[0]
+
+    def invalidate(self, token):
+        """Force a refresh after the service rejected `token`, unless another caller already replaced it."""
+        with self._lock:
+            if self._state[0] == token:
+                self._refresh()
+            return self._state[0]
+
+    def header(self):
+        return {"Authorization": f"Bearer {self.token()}"}
+
+
 class DynamicsAuth:
-    token = None
     auth_url = None
     grant_type = None
     resource = None
     client_id = None
     username = None
     password = None
-    last_refresh = None
-    expires_on = None
-    header = None
     save_token = None
+    tokens = None
 
     def __init__(self, auth_url=None, save_token=True, **kwargs):
         self.token_path = None
+        self.save_token = save_token
         load_dotenv()
-        self.authenticate(**kwargs)
-        self.save_token = save_token or True
-        self.token = self.get_token()
-        mandatory_fields = ['auth_url', 'grant_type', 'resource', 'client_id', 'username', 'password']
-        for field in mandatory_fields:
-            if not getattr(self, field):
-                raise Exception(f"Missing field: {field}")
+        self.authenticate(auth_url=auth_url, **kwargs)
+
+    @property
+    def token(self):
+        return self.tokens.token() if self.tokens else None
+
+    @property
+    def expires_on(self):
+        return self.tokens.expires_on if self.tokens else None
+
+    @property
+    def last_refresh(self):
+        return self.tokens.last_refresh if self.tokens else None
+
+    @property
+    def header(self):
+        return self.tokens.header() if self.tokens else None
 
     def authenticate(self, auth_url=None, grant_type="password", resource=None, client_id=None, username=None, password=None, token_path=None):
         load_dotenv()
@@ -39,22 +135,25 @@ class DynamicsAuth:
         self.username = username or os.getenv('MSDYN_USERNAME')
         self.password = password or os.getenv('MSDYN_PASSWORD')
         self.token_path = token_path or os.getenv('MSDYN_TOKEN_PATH')
-        self.token = self.get_token()
+        mandatory_fields = ['auth_url', 'grant_type', 'resource', 'client_id', 'username', 'password']
+        for field in mandatory_fields:
+            if not getattr(self, field):
+                raise Exception(f"Missing field: {field}")
+        self.tokens = TokenManager.shared((self.auth_url, self.resource, self.client_id, self.username),
+                                          self.request_token)
+        return self.get_token()
 
     def get_token(self, use_saved_token=True, save_token=True):
-        try:
-            with open(self.token_path) as f:
-                token = json.load(f)
-                self.last_refresh = int(time.time())
-                self.expires_on = int(token['expires_on'])
-                if time.time() < self.expires_on:
-                    self.token = token['access_token']
-                    self.header = {
-                        "Authorization": f"Bearer {self.token}",
-                    }
-                    return token['access_token']
-        except FileNotFoundError:
-            return self.get_token(use_saved_token=False)
+        if use_saved_token and self.token_path:
+            try:
+                with open(self.token_path) as f:
+                    token = json.load(f)
+                    self.tokens.seed(token['access_token'], token['expires_on'])
+            except (FileNotFoundError, json.JSONDecodeError, KeyError):
+                pass
+        return self.tokens.token()
+
+    def request_token(self):
         payload = {'grant_type': 'password', 'resource': self.resource,
                    'client_id': self.client_id, 'username': self.username,
                    'password': self.password}
@@ -62,23 +161,16 @@ class DynamicsAuth:
         response = requests.request("POST", self.auth_url, data=payload, headers=headers)
         if response.status_code != 200:
             raise Exception(response.text)
-        if self.save_token:
+        if self.save_token and self.token_path:
             with open(self.token_path, 'w') as f:
                 json.dump(response.json(), f)
-        self.last_refresh = int(time.time())
-        self.expires_on = int(response.json()['expires_on'])
-        self.token = response.json()['access_token']
-        self.header = {
-                    "Authorization": f"Bearer {self.token}",
-                }
-        return self.token
+        return response.json()
+
+    def refresh(self):
+        return self.tokens.refresh()
 
     def get_header(self):
-        if self.token:
-            return self.header
-        else:
-            self.get_token()
-            return self.header
+        return self.header
 
 
 def main():
@@ -0,0 +1,152 @@
+import json
+import uuid
+
+MAX_BATCH_REQUESTS = 1000
+
+
+class BatchRequest:
+    def __init__(self, method, url, body=None, headers=None):
+        self.method = method.upper()
+        self.url = url
+        self.body = body
+        self.headers = headers or {}
+
+    def __repr__(self):
+        return f"BatchRequest<{self.method} {self.url}>"
+
+
+class Changeset(list):
+    """Write requests that the service applies atomically, all or nothing."""
+
+
+class BatchResponse:
+    def __init__(self, status_code, reason="", headers=None, text=""):
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers or {}
+        self.text = text
+
+    def __repr__(self):
+        return f"BatchResponse<{self.status_code} {self.reason}>"
+
+    @property
+    def ok(self):
+        return self.status_code is not None and 200 <= self.status_code < 300
+
+    def json(self):
+        return json.loads(self.text) if self.text else None
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise Exception(f"{self.status_code} {self.reason}: {self.text}")
+
+
+def not_executed():
+    return BatchResponse(424, "Failed Dependency", text='{"error": {"message": "Not executed"}}')
+
+
+def _request_count(item):
+    return len(item) if isinstance(item, Changeset) else 1
+
+
+def chunk_requests(items, max_requests=MAX_BATCH_REQUESTS):
+    chunk, size = [], 0
+    for item in items:
+        count = _request_count(item)
+        if count > max_requests:
+            raise ValueError(f"Changeset of {count} requests exceeds the batch limit of {max_requests}")
+        if chunk and size + count > max_requests:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(item)
+        size += count
+    if chunk:
+        yield chunk
+
+
+def _encode_request(request, base_url, content_id=None):
+    url = request.url if request.url.startswith("http") else f"{base_url}/{request.url.lstrip('/')}"
+    lines = ["Content-Type: application/http", "Content-Transfer-Encoding: binary"]
+    if content_id is not None:
+        lines.append(f"Content-ID: {content_id}")
+    lines += ["", f"{request.method} {url} HTTP/1.1"]
+    headers = {"Accept": "application/json", **request.headers}
+    body = request.body
+    if body is not None and not isinstance(body, str):
+        body = json.dumps(body)
+        headers.setdefault("Content-Type", "application/json; type=entry")
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    lines += ["", body or ""]
+    return "\r\n".join(lines)
+
+
+def build_batch(items, base_url):
+    """Encode requests and changesets as a multipart/mixed $batch body, returning `(body, content_type)`."""
+    boundary = f"batch_{uuid.uuid4()}"
+    parts = []
+    for item in items:
+        if isinstance(item, Changeset):
+            changeset = f"changeset_{uuid.uuid4()}"
+            inner = [f"--{changeset}\r\n{_encode_request(r, base_url, i)}" for i, r in enumerate(item, start=1)]
+            parts.append(f"--{boundary}\r\nContent-Type: multipart/mixed; boundary={changeset}\r\n\r\n"
+                         + "\r\n".join(inner) + f"\r\n--{changeset}--")
+        else:
+            parts.append(f"--{boundary}\r\n{_encode_request(item, base_url)}")
+    body = "\r\n".join(parts) + f"\r\n--{boundary}--\r\n"
+    return body, f"multipart/mixed; boundary={boundary}"
+
+
+def _headers(block):
+    headers = {}
+    for line in block.split("\n"):
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip()] = value.strip()
+    return headers
+
+
+def _boundary(content_type):
+    for param in content_type.split(";"):
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "boundary":
+            return value.strip('"')
+    raise ValueError(f"No boundary in {content_type}")
+
+
+def parse_batch(body, content_type):
+    """Split a $batch response into a flat list of BatchResponse, one per returned operation."""
+    body = body.replace("\r\n", "\n")
+    responses = []
+    for part in body.split(f"--{_boundary(content_type)}")[1:]:
+        if part.startswith("--"):
+            break
+        part_headers, _, message = part.strip("\n").partition("\n\n")
+        part_type = _headers(part_headers).get("Content-Type", "")
+        if part_type.startswith("multipart/mixed"):
+            responses.append(parse_batch(message, part_type))
+            continue
+        status_block, _, text = message.partition("\n\n")
+        status_line, _, header_block = status_block.partition("\n")
+        _, status_code, reason = (status_line.split(" ", 2) + [""])[:3]
+        responses.append(BatchResponse(int(status_code), reason, _headers(header_block), text.strip("\n")))
+    return responses
+
+
+def match_responses(items, responses):
+    """Align parsed responses with the submitted items.
+
+    A failed changeset returns a single error, which is reported for each of
+    its requests. Operations the service did not reach get a 424 response.
+    """
+    results = []
+    responses = iter(responses)
+    for item in items:
+        response = next(responses, None)
+        if isinstance(item, Changeset):
+            if isinstance(response, list):
+                results.append(response + [not_executed()] * (len(item) - len(response)))
+            else:
+                results.append([response or not_executed()] * len(item))
+        else:
+            results.append(response if isinstance(response, BatchResponse) else not_executed())
+    return results
@@ -0,0 +1,137 @@
+import json
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pynamics365.batch import BatchRequest
+from pynamics365.exceptions import DynamicsError, error_for
+
+MESSAGES = {
+    "create": "CreateMultiple",
+    "update": "UpdateMultiple",
+    "upsert": "UpsertMultiple",
+}
+ENTITY_ID = re.compile(r"\(([0-9a-fA-F-]{36})\)$")
+
+
+class BulkResult:
+    def __init__(self, index, ok, status_code=None, id=None, error=None):
+        self.index = index
+        self.ok = ok
+        self.status_code = status_code
+        self.id = id
+        self.error = error
+
+    def __repr__(self):
+        return f"BulkResult<{self.index} {'ok' if self.ok else 'failed'} {self.status_code}>"
+
+
+class BulkWriter:
+    """Write many records to one table through CreateMultiple/UpdateMultiple/UpsertMultiple.
+
+    Records are sent in chunks of `chunk_size`, with up to `max_workers`
+    chunks in flight. The *Multiple messages are all-or-nothing per chunk, so
+    a chunk rejected with a 4xx is replayed record by record in a non-atomic
+    `$batch` to find which records were at fault. A chunk that is still
+    throttled or failing with a 5xx once retries run out is reported as
+    failed records instead, since after a timeout it may have been written.
+    Tables that do not support the messages use `$batch` for every chunk.
+    """
+
+    def __init__(self, client, logical_name, entity_set, operation="create", primary_key=None,
+                 chunk_size=100, max_workers=4, use_multiple=True):
+        if operation not in MESSAGES:
+            raise ValueError(f"Unknown operation {operation}, expected one of {list(MESSAGES)}")
+        if operation != "create" and not primary_key:
+            raise ValueError(f"{operation} requires the primary_key of {logical_name}")
+        self.client = client
+        self.logical_name = logical_name
+        self.entity_set = entity_set
+        self.operation = operation
+        self.primary_key = primary_key
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.use_multiple = use_multiple
+
+    def write(self, records):
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = set()
+            for start, chunk in self._chunks(records):
+                if len(pending) >= self.max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results.extend(future.result())
+                pending.add(executor.submit(self._write_chunk, start, chunk))
+            for future in pending:
+                results.extend(future.result())
+        return sorted(results, key=lambda r: r.index)
+
+    def _chunks(self, records):
+        chunk, start = [], 0
+        for index, record in enumerate(records):
+            if not chunk:
+                start = index
+            chunk.append(record)
+            if len(chunk) == self.chunk_size:
+                yield start, chunk
+                chunk = []
+        if chunk:
+            yield start, chunk
+
+    def _write_chunk(self, start, chunk):
+        """Write one chunk. A chunk that fails outright, e.g. once retries run out, is reported as failed records."""
+        try:
+            if self.use_multiple:
+                results = self._write_multiple(start, chunk)
+                if results is not None:
+                    return results
+            return self._write_batch(start, chunk)
+        except DynamicsError as e:
+            return [BulkResult(start + i, False, e.status_code, chunk[i].get(self.primary_key), str(e))
+                    for i in range(len(chunk))]
+
+    def _write_multiple(self, start, chunk):
+        url = f"{self.client.base_url}/{self.entity_set}/Microsoft.Dynamics.CRM.{MESSAGES[self.operation]}"
+        targets = [{**record, "@odata.type": f"Microsoft.Dynamics.CRM.{self.logical_name}"} for record in chunk]
+        response = self.client.post(url, data=json.dumps({"Targets": targets}))
+        if response.status_code in (404, 501):
+            # The message is not available for this table.
+            self.use_multiple = False
+            return None
+        if not response.ok:
+            error = error_for(response, url)
+            if error.retryable or response.status_code >= 500:
+                raise error
+            return None
+        body = response.json() if response.content else {}
+        if "Ids" in body:
+            ids = body["Ids"]
+        elif "Results" in body:
+            ids = [result.get("Target", {}).get("Id") for result in body["Results"]]
+        else:
+            ids = [record.get(self.primary_key) for record in chunk]
+        return [BulkResult(start + i, True, response.status_code, ids[i] if i < len(ids) else None)
+                for i in range(len(chunk))]
+
+    def _batch_request(self, record):
+        if self.operation == "create":
+            return BatchRequest("POST", self.entity_set, body=record)
+        body = {key: value for key, value in record.items() if key != self.primary_key}
+        headers = {"If-Match": "*"} if self.operation == "update" else {}
+        return BatchRequest("PATCH", f"{self.entity_set}({record[self.primary_key]})", body=body, headers=headers)
+
+    def _write_batch(self, start, chunk):
+        results, requests, indexes = [], [], []
+        for i, record in enumerate(chunk):
+            if self.operation != "create" and not record.get(self.primary_key):
+                results.append(BulkResult(start + i, False, error=f"{self.operation} record has no {self.primary_key}"))
+                continue
+            requests.append(self._batch_request(record))
+            indexes.append(i)
+        responses = self.client.batch(requests) if requests else []
+        for i, response in zip(indexes, responses):
+            match = ENTITY_ID.search(response.headers.get("OData-EntityId", ""))
+            record_id = match.group(1) if match else chunk[i].get(self.primary_key)
+            results.append(BulkResult(start + i, response.ok, response.status_code, record_id,
+                                      None if response.ok else response.text))
+        return results
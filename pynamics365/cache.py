@@ -0,0 +1,242 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_RULES = [
+    # MetadataStore already keeps Attributes, and a second copy could go stale on its own TTL.
+    (r"/EntityDefinitions\([^)]*\)/Attributes", None),
+    (r"/\$metadata", timedelta(days=1)),
+    (r"/api/data/v[\d.]+/?(\?|$)", timedelta(days=1)),
+    (r"/EntityDefinitions", timedelta(hours=1)),
+    (r"/RetrieveTotalRecordCount|/recordcountsnapshots", timedelta(hours=1)),
+]
+KEY_HEADERS = ("Prefer", "Accept")
+
+
+class CachedResponse:
+    def __init__(self, key, url, status_code, headers, body, stored_at, expires_at):
+        self.key = key
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+    def __repr__(self):
+        return f"CachedResponse<{self.status_code} {self.url}>"
+
+    @property
+    def size(self):
+        return len(self.body)
+
+    @property
+    def etag(self):
+        return self.headers.get("ETag")
+
+    @property
+    def fresh(self):
+        return self.expires_at > time.time()
+
+    def to_response(self):
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.body
+        response.url = self.url
+        response.encoding = "utf-8"
+        response.from_cache = True
+        return response
+
+
+class ResponseCache:
+    """Two-tier cache of GET responses: an in-memory LRU in front of a SQLite file.
+
+    Only URLs matching a rule are cached, for that rule's TTL. By default
+    that is metadata, the service document and record counts, never data
+    pages or entity Attributes, which MetadataStore keeps. The memory tier
+    is bounded by entries and the file by total body bytes, evicting the
+    least recently used first. Expired entries with an
+    ETag are revalidated with If-None-Match, so an unchanged response costs
+    a 304 and no body.
+    """
+
+    def __init__(self, path=None, rules=None, memory_entries=256, memory_bytes=64 * 1024 * 1024,
+                 max_bytes=256 * 1024 * 1024):
+        self.path = Path(path) if path else Path(__file__).parent / ".http_cache.sqlite"
+        self.rules = [(re.compile(pattern), ttl) for pattern, ttl in (rules or DEFAULT_RULES)]
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, url TEXT NOT NULL, status_code INTEGER NOT NULL, headers TEXT NOT NULL, "
+                "body BLOB NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL, expires_at REAL NOT NULL, "
+                "accessed_at REAL NOT NULL)"
+            )
+        self._bytes = self._stored_bytes()
+
+    def _stored_bytes(self):
+        with self._lock:
+            return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def ttl_for(self, url):
+        """Return the TTL of the first rule matching `url`. A rule with no TTL keeps the URL out of the cache."""
+        for pattern, ttl in self.rules:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    @staticmethod
+    def key(method, url, params=None, headers=None):
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urlencode(sorted(params.items()))}"
+        varies = {name: (headers or {}).get(name) for name in KEY_HEADERS}
+        return f"{method.upper()} {url} {json.dumps(varies, sort_keys=True)}"
+
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+            row = self._connection.execute(
+                "SELECT url, status_code, headers, body, stored_at, expires_at FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            url, status_code, headers, body, stored_at, expires_at = row
+            entry = CachedResponse(key, url, status_code, json.loads(headers), body, stored_at, expires_at)
+            with self._connection:
+                self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._remember(entry)
+        return entry
+
+    def _remember(self, entry):
+        self._forget(entry.key)
+        if entry.size > self.memory_bytes:
+            return
+        self._memory[entry.key] = entry
+        self._memory_size += entry.size
+        while len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= evicted.size
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= entry.size
+
+    def put(self, key, response, ttl):
+        now = time.time()
+        entry = CachedResponse(key, str(response.url), response.status_code, dict(response.headers), response.content,
+                               now, now + ttl.total_seconds())
+        with self._lock, self._connection:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, entry.url, entry.status_code, json.dumps(entry.headers), entry.body, entry.size,
+                 entry.stored_at, entry.expires_at, now))
+            self._bytes += entry.size - (previous[0] if previous else 0)
+            self._remember(entry)
+            if self._bytes > self.max_bytes:
+                self._evict()
+        return entry
+
+    def refresh(self, entry, ttl):
+        now = time.time()
+        entry.stored_at, entry.expires_at = now, now + ttl.total_seconds()
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE responses SET stored_at = ?, expires_at = ?, accessed_at = ? WHERE key = ?",
+                                     (entry.stored_at, entry.expires_at, now, entry.key))
+        return entry
+
+    def _evict(self):
+        """Drop least recently used rows until the file is back under 90% of max_bytes."""
+        target = self.max_bytes * 0.9
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            evicted.append((key,))
+            self._bytes -= size
+            self._forget(key)
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._bytes -= row[0] if row else 0
+            self._forget(key)
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM responses")
+            self._memory.clear()
+            self._memory_size = 0
+            self._bytes = 0
+
+    def _lookup(self, url, params, headers):
+        key = self.key("GET", url, params, headers)
+        entry = self.get(key)
+        if entry and entry.fresh:
+            self.hits += 1
+            return key, entry, None
+        self.misses += 1
+        request_headers = dict(headers or {})
+        if entry and entry.etag:
+            request_headers["If-None-Match"] = entry.etag
+        return key, entry, request_headers
+
+    def _store(self, key, entry, response, ttl):
+        if response.status_code == 304 and entry:
+            self.revalidated += 1
+            return self.refresh(entry, ttl).to_response()
+        if response.status_code == 200:
+            self.put(key, response, ttl)
+        return response
+
+    def fetch(self, url, send, params=None, headers=None, ttl=None):
+        """Answer a GET from the cache, or call `send(headers)` and cache what it returns.
+
+        `ttl` overrides the rules for this call. URLs with no TTL go straight
+        to `send`.
+        """
+        ttl = ttl or self.ttl_for(url)
+        if not ttl:
+            return send(headers)
+        key, entry, request_headers = self._lookup(url, params, headers)
+        if request_headers is None:
+            return entry.to_response()
+        return self._store(key, entry, send(request_headers), ttl)
+
+    async def afetch(self, url, send, params=None, headers=None, ttl=None):
+        ttl = ttl or self.ttl_for(url)
+        if not ttl:
+            return await send(headers)
+        key, entry, request_headers = self._lookup(url, params, headers)
+        if request_headers is None:
+            return entry.to_response()
+        return self._store(key, entry, await send(request_headers), ttl)
+
+    def close(self):
+        self._connection.close()
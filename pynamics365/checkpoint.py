@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+
+def checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_page(filename, page):
+    """Atomically write a page as JSON and return the checksum of the bytes written."""
+    filename = Path(filename)
+    data = json.dumps(page, indent=2).encode("utf-8")
+    tmp = filename.with_name(f"{filename.name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, filename)
+    return checksum(data)
+
+
+class CheckpointStore:
+    """One small JSON document per entity recording the last committed page.
+
+    A checkpoint holds the page number, the nextLink that fetches the page
+    after it and the checksum of the file written for it. Each update replaces
+    the document atomically, so a crash leaves either the old or the new state.
+    """
+
+    def __init__(self, path="../data/.checkpoints"):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, key):
+        return self.path / f"{key}.json"
+
+    def get(self, key):
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, key, state):
+        state = {**state, "updated": str(datetime.now())}
+        tmp = self._file(f"{key}.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._file(key))
+        return state
+
+    def reset(self, key):
+        self._file(key).unlink(missing_ok=True)
+
+    def commit_page(self, key, page_number, next_link, page_checksum):
+        return self.put(key, {
+            "page": page_number,
+            "next_link": next_link,
+            "checksum": page_checksum,
+            "completed": False,
+        })
+
+    def complete(self, key, page_number=None):
+        state = self.get(key) or {}
+        state["completed"] = True
+        state["next_link"] = None
+        if page_number is not None:
+            state["page"] = page_number
+        return self.put(key, state)
+
+    def is_complete(self, key):
+        state = self.get(key)
+        return bool(state and state.get("completed"))
+
+    def in_progress(self, key):
+        state = self.get(key)
+        return bool(state and not state.get("completed") and state.get("next_link"))
+
+    def resume_point(self, key, page_filename):
+        """Return `(last_good_page, next_link)` for a partial extract, or `(0, None)` to start over.
+
+        `page_filename(page_number)` locates the file written for a page, which
+        must still match the checkpointed checksum to be trusted.
+        """
+        state = self.get(key)
+        if not state or state.get("completed") or not state.get("next_link"):
+            return 0, None
+        filename = Path(page_filename(state["page"]))
+        try:
+            if checksum(filename.read_bytes()) == state["checksum"]:
+                return state["page"], state["next_link"]
+        except FileNotFoundError:
+            pass
+        self.reset(key)
+        return 0, None
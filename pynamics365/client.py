@@ -5,18 +5,36 @@ import time
 from pathlib import Path
 
 import pandas as pd
-# import requests_cache
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 
 from pynamics365.auth import DynamicsAuth
-
-# requests_cache.install_cache('pynamics365_cache')
+from pynamics365.batch import MAX_BATCH_REQUESTS, build_batch, chunk_requests, match_responses, parse_batch
+from pynamics365.bulk import BulkWriter
+from pynamics365.cache import ResponseCache
+from pynamics365.counts import (SNAPSHOT, TOTAL_RECORD_COUNT, count_entry, parse_total_counts, retrieve_counts,
+                                snapshot_counts, total_record_count_query)
+from pynamics365.endpoints import service_entity_sets
+from pynamics365.exceptions import TransientError, error_for, raise_for_response
+from pynamics365.retry import RetryPolicy
+from pynamics365.throttle import AdaptiveLimiter
 
 
 class DynamicsClient:
-    def __init__(self, auth=None, **kwargs):
+    entity_definitions = None
+    record_counts = None
+    entity_sets = None
+
+    def __init__(self, auth=None, pool_size=10, limiter=None, retry=None, cache=None, use_cache=True, **kwargs):
         self.auth = auth or DynamicsAuth(**kwargs)
+        self.limiter = limiter or AdaptiveLimiter()
+        self.retry = retry or RetryPolicy()
+        self.cache = cache if cache is not None else (ResponseCache() if use_cache else None)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         self.auth_token = f"Bearer {self.auth.token}"
         self.headers = {
             "Authorization": self.auth_token,
@@ -30,24 +48,136 @@ class DynamicsClient:
         self.last_refresh = self.auth.last_refresh
         self.expires_on = self.auth.expires_on
 
-    def get(self, url, params=None, **kwargs):
-        if self.token_expired():
-            self.refresh_token()
-        return requests.get(url, headers=self.headers, params=params, **kwargs)
+    def _send(self, method, url, headers, **kwargs):
+        with self.limiter.slot() as outcome:
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                raise TransientError(str(e), url=url) from e
+            outcome.update(status_code=response.status_code, headers=response.headers)
+        return response
+
+    def _authorized_request(self, method, url, headers=None, **kwargs):
+        token = self.auth.tokens.token()
+        request_headers = {**self.headers, **(headers or {}), "Authorization": f"Bearer {token}"}
+        response = self._send(method, url, request_headers, **kwargs)
+        if response.status_code == 401:
+            token = self.auth.tokens.invalidate(token)
+            request_headers["Authorization"] = f"Bearer {token}"
+            response = self._send(method, url, request_headers, **kwargs)
+        return response
+
+    def request(self, method, url, headers=None, **kwargs):
+        """Send a request, retrying throttled and transient failures under `self.retry`.
+
+        The last response is returned as-is once the policy gives up, so
+        callers still decide what a non-2xx status means for them. GETs of
+        metadata-like URLs are answered from `self.cache` when possible.
+        """
+        if self.cache is not None and method == "GET" and not kwargs.get("stream"):
+            return self.cache.fetch(url, lambda h: self._request_with_retry(method, url, h, **kwargs),
+                                    params=kwargs.get("params"), headers={**self.headers, **(headers or {})})
+        return self._request_with_retry(method, url, headers, **kwargs)
+
+    def _request_with_retry(self, method, url, headers=None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                response = self._authorized_request(method, url, headers, **kwargs)
+            except TransientError as e:
+                response, error = None, e
+            else:
+                error = error_for(response, url) if response.status_code >= 400 else None
+            if error is None or not error.retryable:
+                self.retry.succeeded()
+                return response
+            if not self.retry.should_retry(error, attempt, method):
+                if response is None:
+                    raise error
+                return response
+            time.sleep(self.retry.delay(attempt, error))
+            attempt += 1
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        return self.request("GET", url, headers=headers, params=params, **kwargs)
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return self.request("POST", url, headers=headers, data=data, **kwargs)
 
-    def post(self, url, data=None, **kwargs):
-        if self.token_expired():
-            self.refresh_token()
-        return requests.post(url, headers=self.headers, data=data, **kwargs)
+    def patch(self, url, data=None, headers=None, **kwargs):
+        return self.request("PATCH", url, headers=headers, data=data, **kwargs)
+
+    def batch(self, items, continue_on_error=True, max_batch_size=MAX_BATCH_REQUESTS):
+        results = []
+        for chunk in chunk_requests(items, max_batch_size):
+            body, content_type = build_batch(chunk, self.base_url)
+            headers = {"Content-Type": content_type}
+            if continue_on_error:
+                headers["Prefer"] = "odata.continue-on-error"
+            response = self.post(f"{self.base_url}/$batch", data=body.encode("utf-8"), headers=headers)
+            raise_for_response(response, expected=(200, 202))
+            results.extend(match_responses(chunk, parse_batch(response.text, response.headers["Content-Type"])))
+        return results
+
+    def bulk_write(self, logical_name, entity_set, records, operation="create", **kwargs):
+        return BulkWriter(self, logical_name, entity_set, operation=operation, **kwargs).write(records)
 
     def refresh_token(self):
-        self.auth.authenticate()
+        self.auth.refresh()
         self.auth_token = f"Bearer {self.auth.token}"
+        self.headers = {**self.headers, "Authorization": self.auth_token}
         self.last_refresh = self.auth.last_refresh
         self.expires_on = self.auth.expires_on
 
     def token_expired(self):
-        return time.time() > self.expires_on
+        return time.time() > self.auth.expires_on
+
+    def get_all_values(self, url, params=None):
+        response = self.get(url, params=params)
+        raise_for_response(response)
+        res_json = response.json()
+        values = res_json['value']
+        next_link = res_json.get('@odata.nextLink', None)
+        while next_link:
+            response = self.get(next_link)
+            raise_for_response(response)
+            res_json = response.json()
+            values.extend(res_json['value'])
+            next_link = res_json.get('@odata.nextLink', None)
+        return values
+
+    def get_entity_definitions(self):
+        if self.entity_definitions is None:
+            definitions = self.get_all_values(f"{self.base_url}/EntityDefinitions")
+            self.entity_definitions = {e['LogicalName']: e for e in definitions}
+        return self.entity_definitions
+
+    def _total_record_counts(self, logical_names):
+        url_path, params = total_record_count_query(logical_names)
+        response = self.get(f"{self.base_url}/{url_path}", params=params)
+        raise_for_response(response)
+        return parse_total_counts(response.json())
+
+    def get_record_counts(self, logical_names=None):
+        if self.record_counts is None or logical_names:
+            definitions = self.get_entity_definitions()
+            logical_names = list(logical_names or definitions)
+            totals, rejected = retrieve_counts(self._total_record_counts, logical_names)
+            record_counts = {name: count_entry(count, TOTAL_RECORD_COUNT) for name, count in totals.items()}
+            if rejected:
+                snapshots = self.get_all_values(f"{self.base_url}/{SNAPSHOT}",
+                                                params={"$select": "objecttypecode,count,lastupdated"})
+                record_counts.update(snapshot_counts(snapshots, {name: definitions[name] for name in rejected
+                                                                 if name in definitions}))
+            self.record_counts = {**(self.record_counts or {}), **record_counts}
+        return self.record_counts
+
+    def get_entity_sets(self):
+        if self.entity_sets is None:
+            response = self.get(f"{self.base_url}/")
+            raise_for_response(response)
+            self.entity_sets = service_entity_sets(response.json())
+        return self.entity_sets
 
     def get_entities(self, entity_name, select=None, filter=None, expand=None, top=None, orderby=None, count=False):
         url = f"{self.base_url}/{entity_name}"
@@ -65,7 +195,7 @@ class DynamicsClient:
         if count:
             params['$count'] = count
         response = self.get(url, params=params)
-        response.raise_for_status()
+        raise_for_response(response)
         return response.json()
 
     def get_entity(self, entity_name, entity_id, select=None, filter=None, expand=None, top=None, orderby=None, count=False):
@@ -84,5 +214,5 @@ class DynamicsClient:
         if count:
             params['$count'] = count
         response = self.get(url, params=params)
-        response.raise_for_status()
+        raise_for_response(response)
         return response.json()
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime, timezone
+
+from pynamics365.exceptions import PermanentError
+
+TOTAL_RECORD_COUNT = "RetrieveTotalRecordCount"
+SNAPSHOT = "recordcountsnapshots"
+MAX_NAMES = 100
+
+
+def total_record_count_query(logical_names):
+    """Return `(url_path, params)` for one RetrieveTotalRecordCount call over `logical_names`."""
+    return f"{TOTAL_RECORD_COUNT}(EntityNames=@names)", {"@names": json.dumps(list(logical_names))}
+
+
+def parse_total_counts(data):
+    collection = data["EntityRecordCountCollection"]
+    return dict(zip(collection["Keys"], collection["Values"]))
+
+
+def count_entry(count, source, last_updated=None):
+    return {
+        "record_count": int(count),
+        "last_updated": last_updated,
+        "source": source,
+        "counted_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def retrieve_counts(fetch, logical_names, chunk_size=MAX_NAMES):
+    """Count many entities with `fetch(names) -> {name: count}`, `chunk_size` names per call.
+
+    The message fails as a whole if any name in it cannot be counted, so a
+    rejected chunk is halved until the offending names are isolated and left
+    out. Those are returned in the second value for a fallback.
+    """
+    counts, rejected = {}, []
+    pending = [logical_names[i:i + chunk_size] for i in range(0, len(logical_names), chunk_size)]
+    while pending:
+        names = pending.pop()
+        try:
+            counts.update(fetch(names))
+        except PermanentError:
+            if len(names) == 1:
+                rejected.extend(names)
+            else:
+                middle = len(names) // 2
+                pending += [names[:middle], names[middle:]]
+    return counts, rejected
+
+
+def snapshot_counts(snapshots, entities):
+    """Match recordcountsnapshots rows to `{logical_name: entity_definition}` by ObjectTypeCode."""
+    by_type = {s["objecttypecode"]: s for s in snapshots}
+    counts = {}
+    for logical_name, entity in entities.items():
+        snapshot = by_type.get(entity.get("ObjectTypeCode"))
+        if snapshot:
+            counts[logical_name] = count_entry(snapshot["count"], SNAPSHOT, snapshot.get("lastupdated"))
+    return counts
@@ -0,0 +1,44 @@
+from pynamics365.checkpoint import CheckpointStore
+
+TRACK_CHANGES = "odata.track-changes"
+
+
+def is_deleted(record):
+    return record.get("@odata.context", "").endswith("$deletedEntity") or record.get("reason") == "deleted"
+
+
+def split_changes(records):
+    """Split a page of change-tracking records into `(changed, deleted_ids)`."""
+    changed, deleted = [], []
+    for record in records:
+        if is_deleted(record):
+            deleted.append(record.get("id"))
+        else:
+            changed.append(record)
+    return changed, deleted
+
+
+def track_changes_headers(headers):
+    prefer = headers.get("Prefer")
+    if prefer and TRACK_CHANGES in prefer:
+        return headers
+    return {**headers, "Prefer": f"{prefer},{TRACK_CHANGES}" if prefer else TRACK_CHANGES}
+
+
+class DeltaStore(CheckpointStore):
+    """Persists the `@odata.deltaLink` or `modifiedon` watermark of each entity between runs."""
+
+    def __init__(self, path="../data/.delta"):
+        super().__init__(path)
+
+    def delta_link(self, key):
+        return (self.get(key) or {}).get("delta_link")
+
+    def watermark(self, key):
+        return (self.get(key) or {}).get("watermark")
+
+    def save_delta_link(self, key, delta_link):
+        return self.put(key, {"mode": "delta", "delta_link": delta_link})
+
+    def save_watermark(self, key, watermark, field="modifiedon"):
+        return self.put(key, {"mode": "watermark", "watermark": watermark, "field": field})
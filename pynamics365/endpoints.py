@@ -0,0 +1,27 @@
+def needs_verification(entity):
+    """Entities whose EntitySetName may not be queryable through the Web API."""
+    return (not entity.get("EntitySetName")
+            or bool(entity.get("IsPrivate"))
+            or bool(entity.get("IsLogicalEntity"))
+            or entity.get("TableType") == "Virtual")
+
+
+def resolve_endpoint(entity, entity_sets=None):
+    """Resolve an entity's collection URL from its metadata without probing it.
+
+    `entity_sets` is the set of names in the service document and is only
+    consulted for entities that need verification.
+    """
+    endpoint = entity.get("EntitySetName")
+    if needs_verification(entity):
+        if entity_sets is None or endpoint not in entity_sets:
+            return None
+    return endpoint
+
+
+def resolve_endpoints(entities, entity_sets=None):
+    return {name: resolve_endpoint(entity, entity_sets) for name, entity in entities.items()}
+
+
+def service_entity_sets(service_document):
+    return {e['name'] for e in service_document.get('value', []) if e.get('kind', 'EntitySet') == 'EntitySet'}
@@ -1,17 +1,22 @@
 import asyncio
 import json
+import threading
 from datetime import datetime, timedelta
 from math import ceil
 from pathlib import Path
 
 import aiofiles as aiofiles
-import httpx as httpx
-import requests
-# import requests_cache
 from aiopath import AsyncPath
 from tqdm import tqdm
 
+from pynamics365.annotations import AnnotationSplitter
+from pynamics365.checkpoint import CheckpointStore, write_page
+from pynamics365.frames import iter_dataframes, pages_to_dataframe
 from pynamics365.main import DynamicsRequest, DynamicsClient
+from pynamics365.parquet import ParquetPageWriter
+from pynamics365.partition import partition_count
+from pynamics365.scheduler import Job, Scheduler
+from pynamics365.schema import LEAN_ANNOTATIONS, prefer_header, prefer_page_size, select_clause
 import logging
 
 logger = logging.getLogger(__name__)
@@ -23,21 +28,16 @@ fh.setLevel(logging.DEBUG)
 logger.addHandler(fh)
 logger.setLevel(logging.DEBUG)
 
-# requests_cache.install_cache('pynamics365_cache', backend='sqlite', expire_after=timedelta(days=1))
-
-sem = asyncio.Semaphore(10)
-
 
 class DynamicsEntity(DynamicsRequest):
-    endpoint = None
     names = None
-    date_fields = None
-    time_fields = None
-    record_count = None
-    test_record = None
     records = None
     pages = None
-    attributes = None
+    record_last_updated = None
+    _endpoint = None
+    _record_count = None
+    _test_record = None
+    _attributes = None
 
     def __init__(self, dc: DynamicsClient, **kwargs):
         self.entity_record = kwargs
@@ -63,12 +63,53 @@ class DynamicsEntity(DynamicsRequest):
         except TypeError:
             self.description = None
         self.dc = dc
-        self.session = requests.Session()
+        self.session = dc.session
         self.headers = dc.headers
         self.params = {}
-        self._get_attributes()
-        self._get_record_count()
-        self._get_test_record()
+
+    @property
+    def endpoint(self):
+        if self._endpoint is None:
+            self._get_endpoint()
+        return self._endpoint
+
+    @endpoint.setter
+    def endpoint(self, endpoint):
+        self._endpoint = endpoint
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._get_attributes()
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes
+
+    @property
+    def record_count(self):
+        if self._record_count is None:
+            self._get_record_count()
+        return self._record_count
+
+    @record_count.setter
+    def record_count(self, record_count):
+        self._record_count = record_count
+
+    @property
+    def test_record(self):
+        if self._test_record is None:
+            self._get_test_record()
+        return self._test_record
+
+    @property
+    def date_fields(self):
+        return self._get_date_fields()[0]
+
+    @property
+    def time_fields(self):
+        return self._get_date_fields()[1]
 
     def __repr__(self):
         return f"{self.names['display_name']}<Endpoint={self.endpoint}, Count={self.record_count}>"
@@ -87,97 +128,115 @@ class DynamicsEntity(DynamicsRequest):
         }
 
     def _get_attributes(self):
-        metadata_id = self.entity_record['MetadataId']
-        url = f"/EntityDefinitions({metadata_id})/Attributes/"
-        response = self.dc.make_request(url)
-        self.attributes = response.get('value')
-        return self.attributes
+        self._attributes = self.dc.get_attributes(self.names['logical_name'])
+        return self._attributes
 
     def _get_test_record(self):
-        if not self.endpoint:
-            self._get_endpoint()
-        if not self.test_record:
-            self.test_record = self.dc.get_one_record(self.endpoint)
-        return self.test_record
+        if self._test_record is None and self.endpoint:
+            self._test_record = self.dc.get_one_record(self.endpoint)
+        return self._test_record
 
     def _get_endpoint(self):
-        candidate_endpoints = set()
-        for _, name in self.names.items():
-            if name and _ not in ['display_name', 'name']:
-                candidate_endpoints.add(name.lower())
-
-        # Order candidate endpoints by length, longest first
-        candidate_endpoints = sorted(candidate_endpoints, key=len, reverse=True)
-
-        for candidate in candidate_endpoints:
-            test_record = self.dc.get_one_record(candidate)
-            if "error" not in test_record:
-                self.endpoint = candidate
-                break
-        return self.endpoint
+        try:
+            self._endpoint = self.dc.get_entity_endpoint(self.names['logical_name'])
+        except KeyError:
+            self._endpoint = None
+        return self._endpoint
 
     def _get_date_fields(self):
-        test_record = self._get_test_record()
         date_fields = []
         time_fields = []
-        for field in test_record:
-            if "date" in field:
-                date_fields.append(field)
-            if "time" in field:
-                time_fields.append(field)
-        ...
+        for attribute in self.attributes or []:
+            if attribute.get('AttributeType') != "DateTime":
+                continue
+            if attribute.get('Format') == "DateOnly":
+                date_fields.append(attribute['LogicalName'])
+            else:
+                time_fields.append(attribute['LogicalName'])
+        return date_fields, time_fields
 
     def _get_record_count(self):
-        if not self.endpoint:
-            self._get_endpoint()
-        if not self.record_count:
-            url_path = f"/recordcountsnapshots"
-            params = {
-                "$select": "count,lastupdated",
-                "$filter": f"objecttypecode eq {self.object_type_code}",
-            }
-            response = self.dc.make_request(url_path, params=params)
-            if response.get("value"):
-                self.record_count = response.get("value")[0].get("count")
-                self.record_last_updated = response.get("value")[0].get("lastupdated")
-            else:
-                self.record_count = 0
-                self.record_last_updated = None
-        return self.record_count
+        if self._record_count is None:
+            logical_name = self.names['logical_name']
+            record_counts = self.dc.record_counts
+            if record_counts is None:
+                record_counts = self.dc.get_record_counts()
+            elif logical_name not in record_counts:
+                # The metadata store only returns fresh counts, so this one may just have expired.
+                record_counts = self.dc.get_record_counts([logical_name])
+            record_count = record_counts.get(logical_name) or {}
+            self._record_count = int(record_count.get('record_count') or 0)
+            self.record_last_updated = record_count.get('last_updated') or record_count.get('counted_at')
+        return self._record_count
 
 
 class DynamicsEntityExtractor(DynamicsEntity):
     records_last_fetched = None
-
-    def __init__(self, dc: DynamicsClient, use_cache=False, **kwargs):
+    retain = True
+    lean = False
+    columns = None
+    compact = False
+    _params = None
+
+    def __init__(self, dc: DynamicsClient, use_cache=False, retain=True, lean=False, columns=None,
+                 annotations=LEAN_ANNOTATIONS, split_annotations=False, compact=False, **kwargs):
         super().__init__(dc, **kwargs)
-        self.session = requests.Session()
+        self.retain = retain
+        self.compact = compact
+        self.splitter = AnnotationSplitter() if split_annotations else None
+        self.lean = lean
+        self.columns = columns
+        page_size = prefer_page_size(self.dc.headers.get("Prefer"))
+        prefer = prefer_header(annotations if lean else ("*",), page_size)
         self.headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Prefer": 'odata.include-annotations="*",odata.maxpagesize=1000',
+            "Authorization": f"Bearer {self.dc.token}",
+            "Prefer": prefer,
             "Accept": "application/json",
         }
-        self._get_endpoint()
-        self._get_record_count()
-        self._get_test_record()
-        self._get_date_fields()
-        self.estimated_pages = self.estimated_pages()
         self.pages = []
         self.records = []
 
+    @property
+    def params(self):
+        if self.lean and "$select" not in self._params:
+            self._params = {**self._params, "$select": select_clause(self.attributes, self.columns)}
+        return self._params
+
+    @params.setter
+    def params(self, params):
+        self._params = params or {}
+
     def get_all_records(self, **kwargs):
         if not self.endpoint:
             self._get_endpoint()
         if not self.record_count:
             self._get_record_count()
+        compact = kwargs.get("compact", self.compact)
+        attributes = self.attributes if compact else None
+        if not self.retain:
+            return self.dc.get_all_records(self.endpoint, params=self.params, headers=self.headers,
+                                           compact=compact, attributes=attributes)
         if not self.records or self.records_last_fetched < datetime.now() - timedelta(minutes=5):
-            self.records = self.dc.get_all_records(self.endpoint)
+            self.records = self.dc.get_all_records(self.endpoint, params=self.params, headers=self.headers,
+                                                   compact=compact, attributes=attributes)
             self.records_last_fetched = datetime.now()
         return self.records
 
+    def iter_records(self, stream=False, **kwargs):
+        if stream:
+            # Streamed records keep their annotations, since there is no output to save the dictionaries beside.
+            if not self.endpoint:
+                self._get_endpoint()
+            params = kwargs.get("params", self.params)
+            headers = kwargs.get("headers", self.headers)
+            yield from self.dc.stream_records(self.endpoint, params=params, headers=headers,
+                                              next_link=kwargs.get("next_link"))
+            return
+        for page in self.iter_pages(**kwargs):
+            yield from page['value']
+
+    @property
     def estimated_pages(self):
-        if not self.record_count:
-            self._get_record_count()
         if not self.headers.get("Prefer"):
             return self.record_count / 5000
         else:
@@ -202,110 +261,248 @@ class DynamicsEntityExtractor(DynamicsEntity):
         return response, next_link or None
 
     async def aget_first_page(self, **kwargs):
-        if not self.endpoint:
-            self._get_endpoint()
-        params = kwargs.get("params", self.params)
+        # The endpoint and a lean $select may need metadata requests, which block, so resolve them in a thread.
+        endpoint, params = await asyncio.to_thread(lambda: (self.endpoint, kwargs.get("params", self.params)))
         headers = kwargs.get("headers", self.headers)
-        async with httpx.AsyncClient() as client:
-            request_url = self.dc.base_url + self.endpoint
-            response = await client.get(self.endpoint, params=params, headers=headers)
-            next_link = response.get("@odata.nextLink")
-            return response, next_link or None
+        response = await self.dc.aclient.make_request(endpoint, params=params, headers=headers)
+        next_link = response.get("@odata.nextLink")
+        return response, next_link or None
 
     def get_next_page(self, next_link, **kwargs):
         if not self.endpoint:
             self._get_endpoint()
-        params = kwargs.get("params", self.params)
         headers = kwargs.get("headers", self.headers)
-        response = self.dc.make_request(request_url=next_link, params=params, headers=headers)
+        # The nextLink already carries the query options of the first request.
+        response = self.dc.make_request(request_url=next_link, headers=headers)
         next_link = response.get("@odata.nextLink")
         return response, next_link or None
 
     async def aget_next_page(self, next_link, **kwargs):
-        if not self.endpoint:
-            self._get_endpoint()
-        params = kwargs.get("params", self.params)
         headers = kwargs.get("headers", self.headers)
-        async with httpx.AsyncClient() as client:
-            response = await client.get(next_link, params=params, headers=headers)
-            next_link = response.get("@odata.nextLink")
-            return response, next_link or None
+        response = await self.dc.aclient.make_request(request_url=next_link, headers=headers)
+        next_link = response.get("@odata.nextLink")
+        return response, next_link or None
 
-    def get_all_pages(self, **kwargs):
+    def iter_pages(self, next_link=None, **kwargs):
         if not self.endpoint:
             self._get_endpoint()
-        params = kwargs.get("params", self.params)
-        headers = {
-            "Authorization": f"Bearer {self.dc.token}",
-            "Prefer": 'odata.include-annotations="*",odata.maxpagesize=1000',
-            "Accept": "application/json",
-        }
-        first_page = self.get_first_page(headers=headers, **kwargs)
-        match first_page:
-            case (response, next_link):
-                self.pages = [response]
-                yield response
-                while next_link:
-                    next_page = self.get_next_page(next_link, headers=headers, **kwargs)
-                    match next_page:
-                        case (response, next_link):
-                            self.pages.append(response)
-                            yield response
-                        case (response):
-                            self.pages.append(response)
-                            yield response
-                            next_link = None
-            case (response):
-                next_link = None
-                self.pages = [response]
-                yield response
+        kwargs.setdefault("headers", self.headers)
+        if next_link:
+            response, next_link = self.get_next_page(next_link, **kwargs)
+        else:
+            response, next_link = self.get_first_page(**kwargs)
+        yield self.post_process(response)
+        while next_link:
+            response, next_link = self.get_next_page(next_link, **kwargs)
+            yield self.post_process(response)
+
+    def post_process(self, page):
+        """Apply per-page processing, currently moving field annotations into `self.splitter`."""
+        if self.splitter:
+            return self.splitter.split_page(page)
+        return page
+
+    def annotations_filename(self, output_dir):
+        logical_name = self.names["logical_name"]
+        return Path(output_dir) / logical_name / f"{logical_name}_annotations.json"
+
+    def _resume_annotations(self, output_dir):
+        """Carry on from the dictionaries saved with the pages being resumed, which hold their stripped labels."""
+        filename = self.annotations_filename(output_dir)
+        if filename.exists():
+            self.splitter = AnnotationSplitter.load(filename, max_entries=self.splitter.max_entries)
+
+    def get_all_pages(self, **kwargs):
+        self.pages = []
+        for response in self.iter_pages(**kwargs):
+            if self.retain:
+                self.pages.append(response)
+            yield response
 
     async def aget_all_pages(self, **kwargs):
+        response, next_link = await self.aget_first_page(**kwargs)
+        yield self.post_process(response)
+        while next_link:
+            response, next_link = await self.aget_next_page(next_link, **kwargs)
+            yield self.post_process(response)
+
+    def get_partitioned_pages(self, partitions=None, **kwargs):
         if not self.endpoint:
             self._get_endpoint()
+        if not partitions:
+            partitions = partition_count(self.record_count)
         params = kwargs.get("params", self.params)
         headers = kwargs.get("headers", self.headers)
-        first_page = await self.aget_first_page(**kwargs)
-        pages = []
-        match first_page:
-            case (response, next_link):
-                pages = [response]
-                while next_link:
-                    next_page = await self.aget_next_page(next_link, **kwargs)
-                    match next_page:
-                        case (response, next_link):
-                            pages.append(response)
-                        case (response):
-                            pages.append(response)
-                            next_link = None
-            case (response):
-                pages = [response]
-                next_link = None
-        return pages
-
-    def save_all_pages_to_json(self, output_dir, **kwargs):
-        logger.debug(f"Saving est. {self.estimated_pages} pages of {self.names['logical_name']} to {output_dir}.")
-        page_number = 1
-        file_path = Path(output_dir) / Path(self.names["logical_name"])
+        primary_key = self.entity_record['PrimaryIdAttribute']
+        for partition, page in self.dc.iter_partitioned_pages(self.endpoint, primary_key, partitions, params=params,
+                                                              headers=headers, max_workers=kwargs.get("max_workers")):
+            yield partition, self.post_process(page)
+
+    def iter_changes(self, store, **kwargs):
+        if not self.endpoint:
+            self._get_endpoint()
+        change_tracking = bool(self.entity_record.get('ChangeTrackingEnabled'))
+        if not change_tracking:
+            logger.debug(f"Change tracking disabled for {self.names['logical_name']}, using modifiedon watermark.")
+        yield from self.dc.iter_changes(self.endpoint, store, key=self.names['logical_name'],
+                                        change_tracking=change_tracking, params=kwargs.get("params", self.params),
+                                        headers=kwargs.get("headers", self.headers))
+
+    def save_changes_to_json(self, output_dir, store, **kwargs):
+        logical_name = self.names["logical_name"]
+        run = datetime.now().strftime("%Y%m%d%H%M%S")
+        file_path = Path(output_dir) / logical_name
         file_path.mkdir(parents=True, exist_ok=True)
-        for page in self.get_all_pages(**kwargs):
-            with open(f"{file_path}/{self.names['logical_name']}_extract_page_{page_number}.json", "w") as f:
-                json.dump(page, f, indent=2)
-                logger.debug(f"Saved page {page_number}/{self.estimated_pages} of {self.names['logical_name']}")
+        for page_number, page in enumerate(self.iter_changes(store, **kwargs), start=1):
+            write_page(file_path / f"{logical_name}_delta_{run}_page_{page_number}.json", page)
+            logger.debug(f"Saved delta page {page_number} of {logical_name}")
+
+    def page_filename(self, output_dir, page_number, partition=None):
+        logical_name = self.names["logical_name"]
+        if partition is not None:
+            return Path(output_dir) / logical_name / f"{logical_name}_extract_partition_{partition + 1}_page_{page_number}.json"
+        return Path(output_dir) / logical_name / f"{logical_name}_extract_page_{page_number}.json"
+
+    def clear_pages(self, output_dir):
+        """Delete the page files of an earlier extract, so one that switches layout leaves no duplicate rows."""
+        logical_name = self.names["logical_name"]
+        for filename in (Path(output_dir) / logical_name).glob(f"{logical_name}_extract_*page_*.json"):
+            filename.unlink(missing_ok=True)
+
+    def save_all_pages_to_json(self, output_dir, partitions=None, checkpoints: CheckpointStore = None, **kwargs):
+        logical_name = self.names["logical_name"]
+        if checkpoints and checkpoints.is_complete(logical_name):
+            logger.debug(f"Skipping {logical_name}, already extracted.")
+            return
+        logger.debug(f"Saving est. {self.estimated_pages} pages of {logical_name} to {output_dir}.")
+        file_path = Path(output_dir) / Path(logical_name)
+        file_path.mkdir(parents=True, exist_ok=True)
+        if partitions:
+            # Partitioned extracts cannot be resumed, so any earlier output is replaced.
+            self.clear_pages(output_dir)
+            if checkpoints:
+                checkpoints.reset(logical_name)
+            page_numbers = {}
+            for partition, page in self.get_partitioned_pages(partitions, **kwargs):
+                page_number = page_numbers[partition] = page_numbers.get(partition, 0) + 1
+                write_page(self.page_filename(output_dir, page_number, partition), page)
+                logger.debug(f"Saved partition {partition + 1} page {page_number} of {logical_name}")
+            if self.splitter:
+                self.splitter.save(self.annotations_filename(output_dir))
+            if checkpoints:
+                checkpoints.complete(logical_name)
+            return sum(page_numbers.values())
+        page_number, next_link = 0, None
+        if checkpoints:
+            page_number, next_link = checkpoints.resume_point(
+                logical_name, lambda n: self.page_filename(output_dir, n))
+            if next_link:
+                logger.debug(f"Resuming {logical_name} after page {page_number}")
+                if self.splitter:
+                    self._resume_annotations(output_dir)
+        if not next_link:
+            self.clear_pages(output_dir)
+        for page in self.get_all_pages(next_link=next_link, **kwargs):
+            page_number += 1
+            page_checksum = write_page(self.page_filename(output_dir, page_number), page)
+            if checkpoints:
+                if self.splitter:
+                    # The labels stripped from this page must be on disk before a resume can skip it.
+                    self.splitter.save(self.annotations_filename(output_dir))
+                checkpoints.commit_page(logical_name, page_number, page.get("@odata.nextLink"), page_checksum)
+            logger.debug(f"Saved page {page_number}/{self.estimated_pages} of {logical_name}")
+        if self.splitter:
+            self.splitter.save(self.annotations_filename(output_dir))
+        if checkpoints:
+            checkpoints.complete(logical_name, page_number)
+        return page_number
+
+    def save_partition_to_json(self, output_dir, partition, partition_filter, **kwargs):
+        """Save the pages of one key range, as split off by `extraction_job`, and return the page count."""
+        primary_key = self.entity_record['PrimaryIdAttribute']
+        params = {**kwargs.get("params", self.params), "$orderby": f"{primary_key} asc"}
+        if partition_filter:
+            params["$filter"] = partition_filter
+        headers = kwargs.get("headers", self.headers)
+        (Path(output_dir) / self.names["logical_name"]).mkdir(parents=True, exist_ok=True)
+        page_number = 0
+        for page in self.dc.iter_pages(self.endpoint, params=params, headers=headers):
             page_number += 1
+            write_page(self.page_filename(output_dir, page_number, partition), self.post_process(page))
+            logger.debug(f"Saved partition {partition + 1} page {page_number} of {self.names['logical_name']}")
+        if self.splitter:
+            self.splitter.save(self.annotations_filename(output_dir))
+        return page_number
+
+    def extraction_job(self, output_dir, checkpoints: CheckpointStore = None, **kwargs):
+        """Wrap `save_all_pages_to_json` as a scheduler Job that can be split into key-range partitions."""
+        logical_name = self.names["logical_name"]
+
+        def run():
+            return self.save_all_pages_to_json(output_dir, checkpoints=checkpoints, **kwargs)
+
+        def split(parts):
+            if not self.entity_record.get('PrimaryIdAttribute'):
+                return None
+            if checkpoints and (checkpoints.is_complete(logical_name) or checkpoints.in_progress(logical_name)):
+                # Let `run` skip a finished extract, or resume a linear one rather than start over in partitions.
+                return None
+            params = kwargs.get("params", self.params)
+            filters = self.dc.get_partition_filters(self.endpoint, self.entity_record['PrimaryIdAttribute'], parts,
+                                                    params)
+            if len(filters) < 2:
+                return None
+            self.clear_pages(output_dir)
+            if checkpoints:
+                checkpoints.reset(logical_name)
+            remaining = [len(filters)]
+            lock = threading.Lock()
+
+            def partition_job(partition, partition_filter):
+                def run_partition():
+                    pages = self.save_partition_to_json(output_dir, partition, partition_filter, **kwargs)
+                    with lock:
+                        remaining[0] -= 1
+                        if remaining[0] == 0 and checkpoints:
+                            checkpoints.complete(logical_name)
+                    return pages
+
+                return Job(f"{logical_name}[{partition + 1}/{len(filters)}]",
+                           ceil(self.estimated_pages / len(filters)), run_partition)
+
+            return [partition_job(partition, f) for partition, f in enumerate(filters)]
+
+        return Job(logical_name, self.estimated_pages, run, split=split)
+
+    def to_dataframe(self, columns=None, **kwargs):
+        return pages_to_dataframe(self.iter_pages(**kwargs), self.attributes, columns)
+
+    def iter_dataframes(self, chunk_pages=10, columns=None, **kwargs):
+        yield from iter_dataframes(self.iter_pages(**kwargs), self.attributes, chunk_pages, columns)
+
+    def save_all_pages_to_parquet(self, output_dir, **kwargs):
+        logger.debug(f"Saving est. {self.estimated_pages} pages of {self.names['logical_name']} to {output_dir}.")
+        file_path = Path(output_dir) / self.names["logical_name"] / f"{self.names['logical_name']}.parquet"
+        with ParquetPageWriter(file_path, self.attributes) as writer:
+            for page_number, page in enumerate(self.iter_pages(**kwargs), start=1):
+                writer.write_page(page)
+                logger.debug(f"Wrote page {page_number}/{self.estimated_pages} of {self.names['logical_name']}")
+        return file_path
 
     async def asave_all_pages_to_json(self, output_dir, **kwargs):
-        logger.debug(f"Saving est. {self.estimated_pages} pages of {self.names['logical_name']} to {output_dir}.")
+        estimated_pages = await asyncio.to_thread(lambda: self.estimated_pages)
+        logger.debug(f"Saving est. {estimated_pages} pages of {self.names['logical_name']} to {output_dir}.")
         page_number = 1
         file_path = AsyncPath(output_dir) / AsyncPath(self.names["logical_name"])
-        all_pages = await self.aget_all_pages(**kwargs)
-        async for page in all_pages:
-            await file_path.mkdir(parents=True, exist_ok=True)
+        await file_path.mkdir(parents=True, exist_ok=True)
+        async for page in self.aget_all_pages(**kwargs):
             async with aiofiles.open(f"{file_path}/{self.names['logical_name']}_extract_page_{page_number}.json",
                                      "w") as f:
                 await f.write(json.dumps(page, indent=2))
-                logger.debug(f"Saved page {page_number}/{self.estimated_pages} of {self.names['logical_name']}")
+                logger.debug(f"Saved page {page_number}/{estimated_pages} of {self.names['logical_name']}")
             page_number += 1
+        if self.splitter:
+            await asyncio.to_thread(self.splitter.save, self.annotations_filename(output_dir))
 
 
 def main():
@@ -314,8 +511,12 @@ def main():
     logger.info("Got DynamicsClient")
     entity_dict = dc.get_entity_list(use_cache=False)
     logger.info(f"Got entity list of {len(entity_dict)} entities")
+    checkpoints = CheckpointStore("../data/.checkpoints")
     entities = []
     for logical_name, entity in tqdm(entity_dict.items()):
+        if checkpoints.is_complete(logical_name):
+            logger.debug(f"Skipping {logical_name}, already extracted.")
+            continue
         # if logical_name not in ["attribute", "account", "contact", "lead", "opportunity", "systemuser", "opportunityclose",
         #                         "opportunityproduct", "pricelevel", "product", "productpricelevel", "quote",
         #                         "quoteclose", "quotedetail", "uom", "uomschedule"]:
@@ -327,21 +528,23 @@ def main():
             entities.append(de)
             # de.save_all_pages_to_json("../data")
 
-    # Sort entities by record count
-    entities.sort(key=lambda x: x.record_count, reverse=False)
+    scheduler = Scheduler(workers=8)
     for de in entities:
-        de.save_all_pages_to_json("../data")
+        scheduler.add(de.extraction_job("../data", checkpoints=checkpoints))
+    for key, job in scheduler.run().items():
+        if job.error:
+            logger.error(f"{key} failed: {job.error}")
     ...
 
 
 async def get_entity(entity_dict, dc):
-    async with sem:
-        de = DynamicsEntityExtractor(dc, use_cache=False, **entity_dict)
-        logger.debug(f"Got {de}")
-        if de.endpoint:
-            await de.asave_all_pages_to_json("../data")
-        else:
-            return None
+    de = await asyncio.to_thread(DynamicsEntityExtractor, dc, use_cache=False, **entity_dict)
+    # The repr resolves the endpoint and record count, which may send blocking requests.
+    logger.debug(f"Got {await asyncio.to_thread(repr, de)}")
+    if de._endpoint:
+        await de.asave_all_pages_to_json("../data")
+    else:
+        return None
 
 
 async def amain():
@@ -350,21 +553,13 @@ async def amain():
     logger.info("Got DynamicsClient")
     entity_dict = dc.get_entity_list(use_cache=True)
     logger.info(f"Got entity list of {len(entity_dict)} entities")
-    entities = []
-    tasks_todo = []
-    for logical_name, entity in entity_dict.items():
-        # if logical_name not in ["runtimedependency"]:
-        #     continue
-        asyncio.create_task(get_entity(entity, dc))
-        # tasks_todo.append(asyncio.create_task(get_entity(entity, dc)))
-        # de = DynamicsEntityExtractor(dc, use_cache=True, **entity)
-        # logger.debug(f"Got {de}")
-        # if len(entities) > 20:
-        #     break
-        # if de.endpoint:
-        #     entities.append(de)
-        #     # de.save_all_pages_to_json("../data")
-    # await asyncio.gather(*tasks_todo)
+    tasks = [asyncio.create_task(get_entity(entity, dc)) for entity in entity_dict.values()]
+    try:
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(f"Error: {result}")
+    finally:
+        await dc.aclient.aclose()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+from pynamics365.throttle import THROTTLED_STATUS, retry_after
+
+TRANSIENT_STATUS = (408, 500, 502, 503, 504)
+
+
+class DynamicsError(Exception):
+    """A failed Web API request, carrying the status code and response body when there was one."""
+
+    retryable = False
+
+    def __init__(self, message, status_code=None, url=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.url = url
+        self.headers = headers or {}
+
+    @property
+    def retry_after(self):
+        return retry_after(self.headers)
+
+
+class ThrottlingError(DynamicsError):
+    """Service protection rejected the request. It was not executed and can be sent again."""
+
+    retryable = True
+
+
+class TransientError(DynamicsError):
+    """A server error, timeout or dropped connection that may succeed on another attempt."""
+
+    retryable = True
+
+
+class PermanentError(DynamicsError):
+    """A request the service will keep rejecting, such as a bad query or a missing entity set."""
+
+
+def error_for(response, url=None):
+    status_code = response.status_code
+    if status_code in THROTTLED_STATUS and (status_code == 429 or "Retry-After" in response.headers):
+        error_class = ThrottlingError
+    elif status_code in TRANSIENT_STATUS:
+        error_class = TransientError
+    else:
+        error_class = PermanentError
+    return error_class(response.text, status_code, url or str(response.url), response.headers)
+
+
+def raise_for_response(response, expected=(200,), url=None):
+    if response.status_code not in expected:
+        raise error_for(response, url)
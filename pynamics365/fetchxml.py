@@ -0,0 +1,114 @@
+import xml.etree.ElementTree as ET
+from urllib.parse import unquote
+
+PAGING_COOKIE = "@Microsoft.Dynamics.CRM.fetchxmlpagingcookie"
+MORE_RECORDS = "@Microsoft.Dynamics.CRM.morerecords"
+FETCH_ANNOTATIONS = ("Microsoft.Dynamics.CRM.fetchxmlpagingcookie", "Microsoft.Dynamics.CRM.morerecords")
+MAX_PAGE_SIZE = 5000
+AGGREGATES = {"count", "countcolumn", "sum", "avg", "min", "max"}
+DATE_GROUPINGS = {"day", "week", "month", "quarter", "year", "fiscal-period", "fiscal-year"}
+
+
+def entity_name(fetch_xml):
+    return ET.fromstring(fetch_xml).find("entity").get("name")
+
+
+def is_aggregate(fetch_xml):
+    return ET.fromstring(fetch_xml).get("aggregate", "false").lower() == "true"
+
+
+def has_top(fetch_xml):
+    return ET.fromstring(fetch_xml).get("top") is not None
+
+
+def page_fetch(fetch_xml, page, count=MAX_PAGE_SIZE, cookie=None):
+    """Return `fetch_xml` with paging set for `page`, continuing from the paging cookie of the page before."""
+    fetch = ET.fromstring(fetch_xml)
+    fetch.set("page", str(page))
+    fetch.set("count", str(count))
+    if cookie:
+        fetch.set("paging-cookie", cookie)
+    elif "paging-cookie" in fetch.attrib:
+        del fetch.attrib["paging-cookie"]
+    return ET.tostring(fetch, encoding="unicode")
+
+
+def paging_cookie(page):
+    """Extract the paging cookie from a response page, or None when the service did not return one.
+
+    The annotation wraps the real cookie, URL-encoded twice, in the
+    `pagingcookie` attribute of a `<cookie>` element.
+    """
+    annotation = page.get(PAGING_COOKIE)
+    if not annotation:
+        return None
+    cookie = ET.fromstring(annotation).get("pagingcookie")
+    return unquote(unquote(cookie)) if cookie else None
+
+
+def more_records(page):
+    return bool(page.get(MORE_RECORDS))
+
+
+def _conditions(parent, filters):
+    element = ET.SubElement(parent, "filter", type="and")
+    for attribute, operator, *value in filters:
+        condition = ET.SubElement(element, "condition", attribute=attribute, operator=operator)
+        if value and isinstance(value[0], (list, tuple)):
+            for item in value[0]:
+                ET.SubElement(condition, "value").text = str(item)
+        elif value:
+            condition.set("value", str(value[0]))
+
+
+def build_fetch(logical_name, attributes=None, filters=None, order=None, distinct=False):
+    """Build a plain FetchXML query.
+
+    `filters` are `(attribute, operator[, value])` tuples joined with "and",
+    where a list value becomes an "in"-style list of values. `order` is a
+    list of attribute names, prefixed with "-" for descending.
+    """
+    fetch = ET.Element("fetch", mapping="logical")
+    if distinct:
+        fetch.set("distinct", "true")
+    entity = ET.SubElement(fetch, "entity", name=logical_name)
+    if attributes:
+        for attribute in attributes:
+            ET.SubElement(entity, "attribute", name=attribute)
+    else:
+        ET.SubElement(entity, "all-attributes")
+    for attribute in order or []:
+        descending = attribute.startswith("-")
+        ET.SubElement(entity, "order", attribute=attribute.lstrip("-"), descending=str(descending).lower())
+    if filters:
+        _conditions(entity, filters)
+    return ET.tostring(fetch, encoding="unicode")
+
+
+def build_aggregate(logical_name, aggregates, group_by=None, filters=None):
+    """Build an aggregate FetchXML query the server evaluates, returning one row per group.
+
+    `aggregates` maps an alias to `(attribute, function)`, with functions from
+    AGGREGATES, or to `(attribute, "countcolumn", True)` for a distinct count.
+    `group_by` is a list of attribute names, or `(attribute, date_grouping)`
+    pairs to group a DateTime by day, week, month, quarter or year. Each
+    group is aliased by its attribute name.
+    """
+    fetch = ET.Element("fetch", mapping="logical", aggregate="true")
+    entity = ET.SubElement(fetch, "entity", name=logical_name)
+    for alias, (attribute, function, *distinct) in aggregates.items():
+        if function not in AGGREGATES:
+            raise ValueError(f"Unknown aggregate {function}, expected one of {sorted(AGGREGATES)}")
+        element = ET.SubElement(entity, "attribute", name=attribute, alias=alias, aggregate=function)
+        if distinct and distinct[0]:
+            element.set("distinct", "true")
+    for group in group_by or []:
+        attribute, date_grouping = group if isinstance(group, (list, tuple)) else (group, None)
+        element = ET.SubElement(entity, "attribute", name=attribute, alias=attribute, groupby="true")
+        if date_grouping:
+            if date_grouping not in DATE_GROUPINGS:
+                raise ValueError(f"Unknown date grouping {date_grouping}, expected one of {sorted(DATE_GROUPINGS)}")
+            element.set("dategrouping", date_grouping)
+    if filters:
+        _conditions(entity, filters)
+    return ET.tostring(fetch, encoding="unicode")
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from pynamics365.schema import LOOKUP_TYPES, attribute_columns
+
+CATEGORY_TYPES = {"Picklist", "State", "Status", *LOOKUP_TYPES}
+
+
+def _datetimes(values):
+    return pd.to_datetime(values, utc=True, errors="coerce")
+
+
+def _floats(values):
+    return np.array([np.nan if v is None else v for v in values], dtype="float64")
+
+
+def _converter(attribute_type):
+    if attribute_type == "DateTime":
+        return _datetimes
+    if attribute_type in ("Money", "Decimal", "Double"):
+        return _floats
+    if attribute_type == "BigInt":
+        return lambda values: pd.array(values, dtype="Int64")
+    if attribute_type == "Integer":
+        return lambda values: pd.array(values, dtype="Int32")
+    if attribute_type == "Boolean":
+        return lambda values: pd.array(values, dtype="boolean")
+    if attribute_type in CATEGORY_TYPES:
+        return pd.Categorical
+    return lambda values: pd.array(values, dtype="string")
+
+
+def frame_columns(attributes):
+    """Return `(column, converter)` pairs for the readable attributes, in metadata order."""
+    return [(column, _converter(attribute_type)) for column, attribute_type in attribute_columns(attributes)]
+
+
+def pages_to_dataframe(pages, attributes, columns=None):
+    """Build one DataFrame from pages of records, typed from Attributes metadata.
+
+    Values are gathered column by column and each column is converted in a
+    single call, so no intermediate object-dtype frame is built. DateTime
+    becomes datetime64[UTC], Money/Decimal/Double float64, integers
+    nullable Int32/Int64, and option sets and lookups categorical.
+    Uniqueidentifier and text become the string dtype. Keys outside the
+    metadata, such as annotations, are dropped.
+    """
+    converters = frame_columns(attributes)
+    if columns is not None:
+        converters = [(column, convert) for column, convert in converters if column in columns]
+    values = {column: [] for column, _ in converters}
+    for page in pages:
+        records = page['value'] if isinstance(page, dict) else page
+        for column, column_values in values.items():
+            column_values.extend(record.get(column) for record in records)
+    return pd.DataFrame({column: convert(values[column]) for column, convert in converters})
+
+
+def iter_dataframes(pages, attributes, chunk_pages=10, columns=None):
+    """Yield a typed DataFrame for every `chunk_pages` pages, so an entity never has to fit in memory at once."""
+    chunk = []
+    for page in pages:
+        chunk.append(page)
+        if len(chunk) >= chunk_pages:
+            yield pages_to_dataframe(chunk, attributes, columns)
+            chunk = []
+    if chunk:
+        yield pages_to_dataframe(chunk, attributes, columns)
@@ -1,49 +1,75 @@
 import json
+import logging
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
 
+import httpx
 import pandas as pd
-# import requests_cache
 import requests
-import requests_cache
 from dotenv import load_dotenv
-from tqdm.asyncio import tqdm
-# requests_cache.install_cache('pynamics365_cache', backend='sqlite', expire_after=7 * 24 * 60 * 60)
 import asyncio
+import time
+
+from pynamics365.auth import TokenManager
+from pynamics365.batch import MAX_BATCH_REQUESTS, BatchRequest, build_batch, chunk_requests, match_responses, parse_batch
+from pynamics365.cache import ResponseCache
+from pynamics365.checkpoint import write_page
+from pynamics365.counts import (SNAPSHOT, TOTAL_RECORD_COUNT, count_entry, parse_total_counts, retrieve_counts,
+                                snapshot_counts, total_record_count_query)
+from pynamics365.delta import track_changes_headers
+from pynamics365.endpoints import needs_verification, resolve_endpoint, resolve_endpoints, service_entity_sets
+from pynamics365.exceptions import DynamicsError, PermanentError, ThrottlingError, TransientError, raise_for_response
+from pynamics365.fetchxml import (FETCH_ANNOTATIONS, MAX_PAGE_SIZE, build_aggregate, entity_name, has_top,
+                                  is_aggregate, more_records, page_fetch, paging_cookie)
+from pynamics365.metadata import MetadataStore
+from pynamics365.partition import iter_concurrently, partition_filters
+from pynamics365.records import RecordTable
+from pynamics365.retry import RetryPolicy
+from pynamics365.schema import LEAN_ANNOTATIONS, prefer_header, prefer_page_size, select_clause
+from pynamics365.throttle import AdaptiveLimiter
+from pynamics365.stream import CHUNK_SIZE, PageDecoder, aiter_decoded_records, iter_decoded_records
+
+logger = logging.getLogger(__name__)
+
 
 class DynamicsAuth:
-    token = None
     auth_url = None
     grant_type = None
     resource = None
     client_id = None
     username = None
     password = None
+    tokens = None
 
     def __init__(self, auth_url=None, **kwargs):
         load_dotenv()
-        self.auth_url = kwargs.get("auth_url") or os.getenv('MSDYN_AUTH_URL')
+        self.auth_url = auth_url or os.getenv('MSDYN_AUTH_URL')
         self.grant_type = kwargs.get("grant_type") or os.getenv('MSDYN_GRANT_TYPE')
         self.resource = kwargs.get("resource") or os.getenv('MSDYN_RESOURCE')
         self.client_id = kwargs.get("client_id") or os.getenv('MSDYN_CLIENT_ID')
         self.username = kwargs.get("username") or os.getenv('MSDYN_USERNAME')
         self.password = kwargs.get("password") or os.getenv('MSDYN_PASSWORD')
         self.token_path = kwargs.get("token_path") or "./token.json"
-        self.token = self.get_token()
+        self.tokens = TokenManager.shared((self.auth_url, self.resource, self.client_id, self.username),
+                                          self.request_token)
+        self.get_token()
+
+    @property
+    def token(self):
+        return self.tokens.token() if self.tokens else None
 
     def get_token(self, use_saved_token=False, save_token=True):
         if use_saved_token:
             try:
                 with open(self.token_path) as f:
                     token = json.load(f)
-                    expires_on = int(token['expires_on'])
-                    import time
-                    if time.time() < expires_on:
-                        return token['access_token']
+                    self.tokens.seed(token['access_token'], token['expires_on'])
             except FileNotFoundError:
-                return self.get_token(use_saved_token=False, save_token=save_token)
+                pass
+        return self.tokens.token()
 
+    def request_token(self, save_token=True):
         """Authenticate with Dynamics 365"""
         payload = {'grant_type': 'password', 'resource': self.resource,
                    'client_id': self.client_id, 'username': self.username,
@@ -53,9 +79,9 @@ class DynamicsAuth:
         if response.status_code != 200:
             raise Exception(response.text)
         if save_token:
-            with open('token.json', 'w') as f:
+            with open(self.token_path, 'w') as f:
                 json.dump(response.json(), f)
-        return json.loads(response.text)['access_token']
+        return response.json()
 
 
 class DynamicsClient(DynamicsAuth):
@@ -63,14 +89,21 @@ class DynamicsClient(DynamicsAuth):
     headers = None
     last_updated = None
     session = None
+    entity_sets = None
 
-    def __init__(self, base_url=None, use_cache=False, **kwargs):
+    def __init__(self, base_url=None, use_cache=True, **kwargs):
         super().__init__(**kwargs)
         self.endpoints = None
         self.record_counts = None
         self.entities = None
-        self.cached_env = kwargs.get("cached_env") or Path(__file__).parent / ".environment.json"
-        self.base_url = kwargs.get("base_url") or os.getenv('MSDYN_BASE_URL')
+        self.base_url = base_url or os.getenv('MSDYN_BASE_URL')
+        self.metadata = kwargs.get("metadata") or MetadataStore(kwargs.get("metadata_path"))
+        self.limiter = kwargs.get("limiter") or AdaptiveLimiter()
+        self.retry = kwargs.get("retry") or RetryPolicy()
+        cache = kwargs.get("cache")
+        self.cache = cache if cache is not None else (ResponseCache(kwargs.get("cache_path")) if use_cache else None)
+        self.endpoints = self.metadata.get_all(self.base_url, "endpoint") or None
+        self.record_counts = self.metadata.get_all(self.base_url, "record_count") or None
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Prefer": 'odata.include-annotations="*",odata.maxpagesize=1000',
@@ -88,6 +121,38 @@ class DynamicsClient(DynamicsAuth):
 
     ...
 
+    @property
+    def aclient(self):
+        if not getattr(self, "_aclient", None):
+            self._aclient = AsyncDynamicsClient(self)
+        return self._aclient
+
+    def _request_once(self, method, request_url, headers, **kwargs):
+        with self.limiter.slot() as outcome:
+            try:
+                response = self.session.request(method, request_url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                raise TransientError(str(e), url=request_url) from e
+            outcome.update(status_code=response.status_code, headers=response.headers)
+        return response
+
+    def _send(self, method, request_url, headers=None, ttl=None, **kwargs):
+        """Send an authorized request. GETs of metadata-like URLs go through `self.cache`."""
+        if self.cache is not None and method == "GET" and not kwargs.get("stream"):
+            return self.cache.fetch(request_url, lambda h: self._send_authorized(method, request_url, h, **kwargs),
+                                    params=kwargs.get("params"), headers=headers or self.headers, ttl=ttl)
+        return self._send_authorized(method, request_url, headers, **kwargs)
+
+    def _send_authorized(self, method, request_url, headers=None, **kwargs):
+        token = self.tokens.token()
+        headers = {**(headers or self.headers), "Authorization": f"Bearer {token}"}
+        response = self._request_once(method, request_url, headers, **kwargs)
+        if response.status_code == 401:
+            response.close()
+            headers["Authorization"] = f"Bearer {self.tokens.invalidate(token)}"
+            response = self._request_once(method, request_url, headers, **kwargs)
+        return response
+
     def make_request(self, url_path=None, params=None, headers=None, **kwargs):
         if not headers:
             headers = self.headers
@@ -96,15 +161,44 @@ class DynamicsClient(DynamicsAuth):
 
         request_url = kwargs.get("request_url") or f"{self.base_url}/{url_path}"
         method = kwargs.get("method") or "GET"
-        response = self.session.request(method, request_url, headers=headers, params=params)
-        if response.status_code != 200:
-            raise Exception(response.text)
-        data = response.json()
-        return data
 
-    def _get_next_page(self, next_link):
-        response = self.session.request("GET", next_link, headers=self.headers)
-        data = response.json()
+        def attempt():
+            response = self._send(method, request_url, headers=headers, params=params)
+            raise_for_response(response, url=request_url)
+            return response.json()
+
+        return self.retry.call(attempt, method)
+
+    def batch(self, items, continue_on_error=True, max_batch_size=MAX_BATCH_REQUESTS, headers=None):
+        """Send BatchRequests and Changesets through `$batch`, max_batch_size operations per call.
+
+        Returns one BatchResponse per request (a list for each Changeset), in
+        the order given, so failures can be handled per part.
+        """
+        results = []
+        for chunk in chunk_requests(items, max_batch_size):
+            body, content_type = build_batch(chunk, self.base_url)
+            batch_headers = {**(headers or self.headers), "Content-Type": content_type}
+            if continue_on_error:
+                batch_headers["Prefer"] = "odata.continue-on-error"
+
+            def attempt():
+                response = self._send("POST", f"{self.base_url}/$batch", headers=batch_headers,
+                                      data=body.encode("utf-8"))
+                raise_for_response(response, expected=(200, 202))
+                return response
+
+            response = self.retry.call(attempt, "POST")
+            results.extend(match_responses(chunk, parse_batch(response.text, response.headers["Content-Type"])))
+        return results
+
+    def batch_get(self, url_paths, headers=None, **kwargs):
+        request_headers = {k: v for k, v in (headers or self.headers).items() if k != "Authorization"}
+        batch_requests = [BatchRequest("GET", url_path, headers=request_headers) for url_path in url_paths]
+        return self.batch(batch_requests, **kwargs)
+
+    def _get_next_page(self, next_link, headers=None):
+        data = self.make_request(request_url=next_link, headers=headers)
         next_link = data.get("@odata.nextLink")
         return data, next_link
 
@@ -114,130 +208,333 @@ class DynamicsClient(DynamicsAuth):
 
     def get_entity_list(self, **kwargs):
         if not self.entities:
-            entities = self.get_all_records("EntityDefinitions", **kwargs)
-            self.entities = {e['LogicalName']: e for e in entities}
+            cached = self.metadata.get_all(self.base_url, "entity", fresh_only=False)
+            if cached and self.metadata.is_fresh(self.base_url, "entity"):
+                self.entities = cached
+            elif cached:
+                self.entities = self._revalidate_entities(cached)
+            else:
+                entities = self.get_all_records("EntityDefinitions", **kwargs)
+                self.entities = {e['LogicalName']: e for e in entities}
+                self.metadata.put_many(self.base_url, "entity", self.entities)
         return self.entities
 
-    def get_all_records(self, endpoint, **kwargs):
+    def _revalidate_entities(self, cached):
+        fingerprint = ["MetadataId", "LogicalName", "EntitySetName", "ObjectTypeCode", "ChangeTrackingEnabled"]
+        current = self.get_all_records("EntityDefinitions", params={"$select": ",".join(fingerprint)})
+        current = {e['LogicalName']: e for e in current}
+        changed = [name for name, e in current.items()
+                   if name not in cached or any(cached[name].get(f) != e.get(f) for f in fingerprint)]
+        removed = [name for name in cached if name not in current]
+        unchanged = [name for name in current if name not in changed]
+        if len(changed) > len(current) // 2:
+            entities = {e['LogicalName']: e for e in self.get_all_records("EntityDefinitions")}
+            self.metadata.delete(self.base_url, "entity")
+            self.metadata.put_many(self.base_url, "entity", entities)
+            return entities
+        entities = {name: cached[name] for name in unchanged}
+        for name in changed:
+            entities[name] = self.make_request(f"EntityDefinitions(LogicalName='{name}')")
+        self.metadata.delete(self.base_url, "entity", removed)
+        self.metadata.touch(self.base_url, "entity", unchanged)
+        self.metadata.put_many(self.base_url, "entity", {name: entities[name] for name in changed})
+        return entities
+
+    def get_attributes(self, logical_name):
+        attributes = self.metadata.get(self.base_url, "attributes", logical_name)
+        if attributes is None:
+            attributes = self.get_all_records(f"EntityDefinitions(LogicalName='{logical_name}')/Attributes")
+            self.metadata.put(self.base_url, "attributes", logical_name, attributes)
+        return attributes
+
+    def _logical_name(self, endpoint):
+        for logical_name, entity_set in (self.endpoints or {}).items():
+            if entity_set == endpoint:
+                return logical_name
+        for logical_name, entity in (self.get_entity_list() or {}).items():
+            if entity.get("EntitySetName") == endpoint:
+                return logical_name
+        raise KeyError(endpoint)
+
+    def lean_query(self, endpoint, params=None, headers=None, columns=None, annotations=LEAN_ANNOTATIONS,
+                   page_size=None):
+        """Return `(params, headers)` that select only readable columns and the wanted annotations.
+
+        Without lean mode every page carries all columns and every annotation
+        of every field, roughly twice the bytes of the data itself. The page
+        size defaults to the `odata.maxpagesize` already in `headers`.
+        """
+        params = dict(params or {})
+        if endpoint and "$select" not in params:
+            params["$select"] = select_clause(self.get_attributes(self._logical_name(endpoint)), columns)
+        headers = headers or self.headers
+        page_size = page_size or prefer_page_size(headers.get("Prefer"))
+        headers = {**headers, "Prefer": prefer_header(annotations, page_size)}
+        return params, headers
+
+    def _query(self, endpoint, kwargs):
         params = kwargs.get("params") or {}
-        headers = self.headers
-        request_url = f"{self.base_url}/{endpoint}"
-        # if kwargs.get("use_cache"):
-        #     session = requests_cache.CachedSession(cache_name='pynamics365_cache', backend='sqlite', expire_after=7 * 24 * 60 * 60)
-        #     response = session.request("GET", request_url, headers=headers)
-        # else:
-        #     response = self.session.request("GET", request_url, headers=headers)
-        response = self.session.request("GET", request_url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(response.text)
-        data = response.json()
-        records = [*data['value']]
-        next_link = data.get("@odata.nextLink")
+        headers = kwargs.get("headers") or self.headers
+        if kwargs.get("lean"):
+            # A nextLink already carries $select, but each request still needs the lean Prefer header.
+            params, headers = self.lean_query(None if kwargs.get("next_link") else endpoint, params, headers,
+                                              kwargs.get("columns"), kwargs.get("annotations", LEAN_ANNOTATIONS))
+        return params, headers
+
+    def iter_pages(self, endpoint=None, **kwargs):
+        """Yield each page of `endpoint`, following nextLinks.
+
+        With `lean=True` the request selects only readable columns (or the
+        given `columns`) and only the `annotations` families asked for.
+        """
+        params, headers = self._query(endpoint, kwargs)
+        next_link = kwargs.get("next_link")
+        if next_link:
+            data, next_link = self._get_next_page(next_link, headers=headers)
+        else:
+            data = self.make_request(endpoint, params=params, headers=headers)
+            next_link = data.get("@odata.nextLink")
+        yield data
         while next_link:
-            data, next_link = self._get_next_page(next_link)
-            records.extend(data['value'])
-        return records
+            data, next_link = self._get_next_page(next_link, headers=headers)
+            yield data
 
-    def _cache_environment_to_json(self, filename=None):
-        if not filename:
-            filename = self.cached_env
-        else:
-            filename = Path(filename)
-            filename.parent.mkdir(parents=True, exist_ok=True)
-        if not filename.exists():
-            filename.touch()
-        with open(filename, "r") as f:
-            try:
-                environment = json.load(f)
-            except json.decoder.JSONDecodeError:
-                environment = {}
-
-        environment[self.base_url] = {
-            "last_updated": str(self.last_updated),
-            "endpoints": self.endpoints,
-            "record_counts": self.record_counts,
-            "entities": self.entities
-        }
-        with open(filename, "w") as f:
-            json.dump(environment, f, indent=2)
+    def iter_records(self, endpoint=None, stream=False, **kwargs):
+        if stream:
+            yield from self.stream_records(endpoint, **kwargs)
+            return
+        for page in self.iter_pages(endpoint, **kwargs):
+            yield from page['value']
 
-    def _load_environment_from_json(self, filename=".environment.json"):
-        if not filename:
-            filename = Path(__file__).parent / ".environment.json"
-        else:
-            filename = Path(filename)
-        with open(filename, "r") as f:
+    def _open_stream(self, request_url, params=None, headers=None):
+        def attempt():
+            response = self._send("GET", request_url, headers=headers, params=params, stream=True)
             try:
-                environment = json.load(f)
-            except json.decoder.JSONDecodeError:
-                environment = {}
-        try:
-            self.endpoints = environment[self.base_url]["endpoints"]
-            self.record_counts = environment[self.base_url]["record_counts"]
-            self.entities = environment[self.base_url]["entities"]
-            self.last_updated = datetime.strptime(environment[self.base_url]["last_updated"], "%Y-%m-%d %H:%M:%S.%f")
-        except KeyError:
-            pass
+                raise_for_response(response, url=request_url)
+            except DynamicsError:
+                response.close()
+                raise
+            return response
+
+        return self.retry.call(attempt)
+
+    def _stream_page(self, request_url, decoder, params=None, headers=None):
+        """Yield the records of one page, re-requesting the page if the connection drops part way.
+
+        Records that were already yielded before the failure are skipped on
+        the new attempt, so the caller sees each record once.
+        """
+        yielded, attempt = 0, 0
+        while True:
+            decoder.reset()
+            try:
+                with self._open_stream(request_url, params, headers) as response:
+                    for seen, record in enumerate(
+                            iter_decoded_records(response.iter_content(chunk_size=CHUNK_SIZE), decoder), start=1):
+                        if seen > yielded:
+                            yielded += 1
+                            yield record
+                return
+            except requests.RequestException as e:
+                error = TransientError(str(e), url=request_url)
+                if not self.retry.should_retry(error, attempt):
+                    raise error from e
+            time.sleep(self.retry.delay(attempt, error))
+            attempt += 1
+
+    def stream_records(self, endpoint=None, **kwargs):
+        params, headers = self._query(endpoint, kwargs)
+        next_link = kwargs.get("next_link")
+        if not next_link:
+            decoder = PageDecoder()
+            yield from self._stream_page(f"{self.base_url}/{endpoint}", decoder, params=params, headers=headers)
+            next_link = decoder.next_link
+        while next_link:
+            decoder = PageDecoder()
+            yield from self._stream_page(next_link, decoder, headers=headers)
+            next_link = decoder.next_link
+
+    def get_all_records(self, endpoint, compact=False, attributes=None, **kwargs):
+        """Return every record of `endpoint` as a list of dicts, or as a RecordTable with `compact=True`.
+
+        The table is typed from `attributes`, looked up from metadata when
+        not given, and holds each column in one array instead of repeating
+        every key in every row.
+        """
+        records = self.iter_records(endpoint, **kwargs)
+        if not compact:
+            return list(records)
+        if attributes is None:
+            attributes = self.get_attributes(self._logical_name(endpoint))
+        table = RecordTable.from_attributes(attributes)
+        table.extend(records)
+        return table
 
     def _get_one_page(self, endpoint, **kwargs):
         if not self.session:
             self.session = requests.Session()
         params = kwargs.get("params") or {}
         headers = kwargs.get("headers") or self.headers
-        request_url = f"{self.base_url}/{endpoint}"
-        response = self.session.request("GET", request_url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(response.text)
-        data = response.json()
+        data = self.make_request(endpoint, params=params, headers=headers)
         next_link = data.get("@odata.nextLink")
         return data, next_link
 
     def get_all_pages(self, endpoint, **kwargs):
+        return list(self.iter_pages(endpoint, **kwargs))
+
+    def iter_fetchxml(self, fetch_xml, page_size=MAX_PAGE_SIZE, headers=None):
+        """Yield the pages of a FetchXML query, following paging cookies.
+
+        Aggregate queries cannot use paging cookies and are paged by number
+        instead. The server refuses aggregates over more than 50,000 records.
+        A query with `top` is sent once, unpaged.
+        """
+        endpoint = self.get_entity_endpoint(entity_name(fetch_xml))
+        if not headers:
+            headers = {**self.headers, "Prefer": prefer_header(("formatted", "lookup", *FETCH_ANNOTATIONS), None)}
+        if has_top(fetch_xml):
+            yield self.make_request(endpoint, params={"fetchXml": fetch_xml}, headers=headers)
+            return
+        aggregate = is_aggregate(fetch_xml)
+        page_number, cookie = 1, None
+        while True:
+            query = page_fetch(fetch_xml, page_number, page_size, cookie)
+            page = self.make_request(endpoint, params={"fetchXml": query}, headers=headers)
+            yield page
+            if not more_records(page):
+                return
+            page_number += 1
+            cookie = None if aggregate else paging_cookie(page)
+
+    def fetchxml(self, fetch_xml, **kwargs):
+        return [record for page in self.iter_fetchxml(fetch_xml, **kwargs) for record in page['value']]
+
+    def aggregate(self, logical_name, aggregates, group_by=None, filters=None):
+        """Run a group-by aggregate on the server, e.g. counts per owner or per month, see build_aggregate."""
+        return self.fetchxml(build_aggregate(logical_name, aggregates, group_by, filters))
+
+    def iter_changes(self, endpoint, store, key=None, change_tracking=True, watermark_field="modifiedon", **kwargs):
+        """Yield only the pages changed since the previous run recorded in `store`.
+
+        With change tracking the first run is a full sync that ends in an
+        `@odata.deltaLink`; later runs follow that link and also receive deleted
+        rows (see delta.split_changes). A link the service rejects, such as an
+        expired one, is dropped and the full sync runs again. Otherwise records
+        with `watermark_field` at or after the stored watermark are fetched.
+        State is saved only once every page has been consumed.
+        """
+        key = key or endpoint
+        params = dict(kwargs.get("params") or {})
+        headers = kwargs.get("headers") or self.headers
+        if change_tracking:
+            headers = track_changes_headers(headers)
+            delta_link = store.delta_link(key)
+            if delta_link:
+                pages = self._iter_delta_pages(endpoint, store, key, delta_link, params, headers)
+            else:
+                pages = self.iter_pages(endpoint, params=params, headers=headers)
+            # A rejected link is dropped from `store`, so only a link returned by this run is saved.
+            delta_link = None
+            for page in pages:
+                yield page
+                delta_link = page.get("@odata.deltaLink") or delta_link
+            if delta_link:
+                store.save_delta_link(key, delta_link)
+            return
+        watermark = store.watermark(key)
+        if watermark:
+            watermark_filter = f"{watermark_field} ge {watermark}"
+            params["$filter"] = f"({params['$filter']}) and {watermark_filter}" if params.get("$filter") else watermark_filter
+        for page in self.iter_pages(endpoint, params=params, headers=headers):
+            yield page
+            for record in page['value']:
+                value = record.get(watermark_field)
+                if value and (not watermark or value > watermark):
+                    watermark = value
+        if watermark:
+            store.save_watermark(key, watermark, watermark_field)
+
+    def _iter_delta_pages(self, endpoint, store, key, delta_link, params, headers):
+        """Follow a stored deltaLink, or start a full sync again if the service no longer accepts it."""
+        pages = self.iter_pages(next_link=delta_link, headers=headers)
+        try:
+            first = next(pages)
+        except PermanentError as e:
+            if not e.status_code or not 400 <= e.status_code < 500:
+                raise
+            logger.warning(f"Delta link for {key} was rejected ({e.status_code}), starting a full sync again")
+            store.reset(key)
+            yield from self.iter_pages(endpoint, params=params, headers=headers)
+            return
+        yield first
+        yield from pages
+
+    def get_key_range(self, endpoint, primary_key, params=None):
+        params = {**(params or {}), "$select": primary_key, "$top": 1}
+        first = self.make_request(endpoint, params={**params, "$orderby": f"{primary_key} asc"})['value']
+        last = self.make_request(endpoint, params={**params, "$orderby": f"{primary_key} desc"})['value']
+        if not first or not last:
+            return None
+        return first[0][primary_key], last[0][primary_key]
+
+    def get_partition_filters(self, endpoint, primary_key, partitions, params=None):
+        params = params or {}
+        base_params = {"$filter": params["$filter"]} if params.get("$filter") else None
+        key_range = self.get_key_range(endpoint, primary_key, params=base_params)
+        if not key_range:
+            return []
+        return partition_filters(primary_key, *key_range, partitions, base_filter=params.get("$filter"))
+
+    def iter_partitioned_pages(self, endpoint, primary_key, partitions=4, **kwargs):
         params = kwargs.get("params") or {}
         headers = kwargs.get("headers") or self.headers
-        request_url = f"{self.base_url}/{endpoint}"
-        response = self.session.request("GET", request_url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(response.text)
-        data = response.json()
-        pages = [data]
-        next_link = data.get("@odata.nextLink")
-        while next_link:
-            data, next_link = self._get_next_page(next_link)
-            pages.append(data)
-        return pages
+        filters = self.get_partition_filters(endpoint, primary_key, partitions, params=params)
+        producers = []
+        for partition_filter in filters:
+            partition_params = {**params, "$orderby": f"{primary_key} asc"}
+            if partition_filter:
+                partition_params["$filter"] = partition_filter
+            producers.append(lambda p=partition_params: self.iter_pages(endpoint, params=p, headers=headers))
+        yield from iter_concurrently(producers, max_workers=kwargs.get("max_workers"))
 
     def get_one_record(self, endpoint):
         request_url = f"{self.base_url}/{endpoint}"
         params = {
             "$top": 1,
         }
-        session = requests_cache.CachedSession(cache_name='pynamics365_cache', backend='sqlite', expire_after=1 * 24 * 60 * 60)
-        response = session.request("GET", request_url, params=params, headers=self.headers)
+        response = self._send("GET", request_url, headers=self.headers, params=params, ttl=timedelta(days=1))
         return response.json()
 
-    def get_record_counts(self):
-        record_count_snapshots = {}
-        for rcss in self.get_all_records("recordcountsnapshots"):
-            object_type_code = rcss.pop("objecttypecode")
-            record_count_snapshots[object_type_code] = rcss
-
-        record_counts = {}
-        for entity_name, entity in self.get_entity_list().items():
-            if not entity_name:
-                entity_name = entity['LogicalName'] or entity['SchemaName']
-            object_type = entity['ObjectTypeCode']
-            try:
-                record_count = record_counts.get(object_type)
-                record_counts[entity_name] = {
-                    'record_count': record_count_snapshots[object_type]['count'],
-                    'last_updated': record_count_snapshots[object_type]['lastupdated']
-                }
-            except KeyError as e:
-                print(f"KeyError: {e}")
-                pass
-        self.record_counts = record_counts
-        return record_counts
+    def _total_record_counts(self, logical_names):
+        url_path, params = total_record_count_query(logical_names)
+        return parse_total_counts(self.make_request(url_path, params=params))
+
+    def get_record_counts(self, logical_names=None):
+        """Count `logical_names` (default: every entity) with bulk RetrieveTotalRecordCount calls.
+
+        Entities the message rejects fall back to recordcountsnapshots. Each
+        count records its `source` and when it was taken in `counted_at`;
+        entities neither could count are recorded as 0 with no source.
+        """
+        entities = self.get_entity_list()
+        logical_names = list(logical_names or [name for name in entities if name])
+        totals, rejected = retrieve_counts(self._total_record_counts, logical_names)
+        record_counts = {name: count_entry(count, TOTAL_RECORD_COUNT) for name, count in totals.items()}
+        if rejected:
+            snapshots = self.get_all_records(SNAPSHOT, params={"$select": "objecttypecode,count,lastupdated"})
+            record_counts.update(snapshot_counts(snapshots, {name: entities[name] for name in rejected
+                                                             if name in entities}))
+        # Names no source could count are stored as 0, so they are not requested again until the entry expires.
+        for name in logical_names:
+            record_counts.setdefault(name, count_entry(0, None))
+        self.record_counts = {**(self.record_counts or {}), **record_counts}
+        self.metadata.put_many(self.base_url, "record_count", record_counts)
+        return self.record_counts
+
+    def get_entity_sets(self):
+        if self.entity_sets is None:
+            self.entity_sets = service_entity_sets(self.make_request(""))
+        return self.entity_sets
 
     def get_entity_endpoint(self, entity_name):
         endpoints = self.endpoints or {}
@@ -245,71 +542,61 @@ class DynamicsClient(DynamicsAuth):
             raise Exception(f"Entity {entity_name} not found.")
         if endpoints.get(entity_name):
             return endpoints[entity_name]
-        candidate_endpoints = ['LogicalCollectionName', 'LogicalName', 'SchemaName']
-        for candidate in candidate_endpoints:
-            test_record = self.get_one_record(f"{self.entities[entity_name][candidate]}")
-            if "error" not in test_record:
-                endpoints[entity_name] = self.entities[entity_name][candidate]
-                break
+        entity = self.entities[entity_name]
+        entity_sets = self.get_entity_sets() if needs_verification(entity) else None
+        endpoint = resolve_endpoint(entity, entity_sets)
+        if not endpoint:
+            raise KeyError(entity_name)
+        endpoints[entity_name] = endpoint
         self.endpoints = endpoints
-        self._cache_environment_to_json()
-        return endpoints[entity_name]
+        self.metadata.put(self.base_url, "endpoint", entity_name, endpoint)
+        return endpoint
 
     def get_valid_entity_endpoints(self):
-        endpoints = self.endpoints or {}
-        candidate_endpoints = ['LogicalCollectionName', 'LogicalName', 'SchemaName']
-        pbar = tqdm(self.entities.items())
-        for entity_name, entity in pbar:
-            try:
-                pbar.set_description(f"Testing {entity_name}...")
-                if entity_name in self.endpoints:
-                    continue
-                else:
-                    for candidate in candidate_endpoints:
-                        test_url = f"{self.base_url}/{entity[candidate]}"
-                        pbar.set_description(f"Testing {entity_name} at {entity[candidate]}")
-                        response = self.session.request("GET", test_url, headers=self.headers)
-                        if response.status_code == 200:
-                            endpoints[entity_name] = entity[candidate]
-                            pbar.set_description(f"Found {entity['LogicalName']} at {entity[candidate]}")
-                            break
-                    endpoints[entity_name] = None
-            except KeyboardInterrupt:
-                break
+        entity_sets = None
+        if any(needs_verification(entity) for entity in self.entities.values()):
+            entity_sets = self.get_entity_sets()
+        endpoints = resolve_endpoints(self.entities, entity_sets)
         self.endpoints = endpoints
-        self._cache_environment_to_json()
+        self.metadata.put_many(self.base_url, "endpoint", {k: v for k, v in endpoints.items() if v})
         return endpoints
 
     def save_entity_records_to_file(self, entity_name, output_path=None):
-        if not output_path:
-            filename = Path("../data") / entity_name / f"{entity_name}.json"
-        records = self.get_all_records(entity_name)
-        if not records:
+        filename = entity_output_filename(output_path, entity_name)
+        records = self.iter_records(entity_name, stream=True)
+        first_record = next(records, None)
+        if first_record is None:
             return
-        filename.parent.mkdir(parents=True, exist_ok=True)
-
         with open(filename, "w") as f:
-            json.dump(self.get_all_records(entity_name), f, indent=2)
-
-    def save_entity_pages_to_file(self, entity_name, output_path="../data"):
-        page = 1
+            f.write("[\n")
+            json.dump(first_record, f, indent=2)
+            for record in records:
+                f.write(",\n")
+                json.dump(record, f, indent=2)
+            f.write("\n]")
+
+    def save_entity_pages_to_file(self, entity_name, output_path="../data", checkpoints=None):
         if not output_path:
             output_path = Path("../data")
-        filename = entity_output_filename(output_path, entity_name, page)
-        entity_page, next_link = self._get_one_page(entity_name)
-        with open(filename, "w") as f:
-            print(f"Saving page {page} of {entity_name} to {filename}...")
-            json.dump(entity_page, f, indent=2)
-        while next_link:
+        if checkpoints and checkpoints.is_complete(entity_name):
+            print(f"Skipping {entity_name}, already saved to {output_path}.")
+            return
+        page, next_link = 0, None
+        if checkpoints:
+            page, next_link = checkpoints.resume_point(
+                entity_name, lambda n: entity_output_filename(output_path, entity_name, n))
+        for entity_page in self.iter_pages(entity_name, next_link=next_link):
             page += 1
             filename = entity_output_filename(output_path, entity_name, page)
-            entity_page, next_link = self._get_next_page(next_link)
-            with open(filename, "w") as f:
-                print(f"Saving page {page} of {entity_name} to {filename}...")
-                json.dump(entity_page, f, indent=2)
-            if not next_link or len(entity_page['value']) == 0:
-                print(f"Finished saving {entity_name} to {output_path}.")
+            print(f"Saving page {page} of {entity_name} to {filename}...")
+            page_checksum = write_page(filename, entity_page)
+            if checkpoints:
+                checkpoints.commit_page(entity_name, page, entity_page.get("@odata.nextLink"), page_checksum)
+            if len(entity_page['value']) == 0:
                 break
+        if checkpoints:
+            checkpoints.complete(entity_name, page)
+        print(f"Finished saving {entity_name} to {output_path}.")
 
 def entity_output_filename(output_path, entity_name, page=None):
     if not output_path:
@@ -322,7 +609,209 @@ def entity_output_filename(output_path, entity_name, page=None):
     return filename
 
 class AsyncDynamicsClient:
-    ...
+    """Async counterpart of DynamicsClient sharing one pooled httpx client.
+
+    All requests go through a single keep-alive connection pool and the
+    DynamicsClient's adaptive limiter, so any number of entities can be
+    extracted concurrently while the number of requests in flight follows
+    the service protection limits.
+    """
+    client = None
+
+    def __init__(self, dc=None, max_connections=52, timeout=120.0, **kwargs):
+        self.dc = dc or DynamicsClient(**kwargs)
+        self.base_url = self.dc.base_url
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.timeout = httpx.Timeout(timeout)
+
+    @property
+    def headers(self):
+        return self.dc.headers
+
+    async def __aenter__(self):
+        self._get_client()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    def _get_client(self):
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self.client
+
+    async def aclose(self):
+        if self.client is not None and not self.client.is_closed:
+            await self.client.aclose()
+        self.client = None
+
+    async def _send(self, client, method, request_url, headers, params=None):
+        limiter = self.dc.limiter
+        await limiter.aacquire()
+        try:
+            response = await client.request(method, request_url, headers=headers, params=params)
+        except httpx.TransportError as e:
+            limiter.release()
+            raise TransientError(str(e), url=request_url) from e
+        except BaseException:
+            limiter.release()
+            raise
+        limiter.release(response.status_code, response.headers)
+        return response
+
+    async def _request(self, method, request_url, headers=None, params=None):
+        cache = self.dc.cache
+        if cache is not None and method == "GET":
+            return await cache.afetch(request_url, lambda h: self._authorized_request(method, request_url, h, params),
+                                      params=params, headers=headers or self.headers)
+        return await self._authorized_request(method, request_url, headers, params)
+
+    async def _authorized_request(self, method, request_url, headers=None, params=None):
+        client = self._get_client()
+        token = await self.dc.tokens.atoken()
+        headers = {**(headers or self.headers), "Authorization": f"Bearer {token}"}
+        response = await self._send(client, method, request_url, headers, params)
+        if response.status_code == 401:
+            token = await asyncio.to_thread(self.dc.tokens.invalidate, token)
+            headers["Authorization"] = f"Bearer {token}"
+            response = await self._send(client, method, request_url, headers, params)
+        return response
+
+    async def make_request(self, url_path=None, params=None, headers=None, **kwargs):
+        request_url = kwargs.get("request_url") or f"{self.base_url}/{url_path}"
+        method = kwargs.get("method") or "GET"
+
+        async def attempt():
+            response = await self._request(method, request_url, headers=headers, params=params or None)
+            raise_for_response(response, url=request_url)
+            return response.json()
+
+        return await self.dc.retry.acall(attempt, method)
+
+    async def _get_next_page(self, next_link, headers=None):
+        data = await self.make_request(request_url=next_link, headers=headers)
+        next_link = data.get("@odata.nextLink")
+        return data, next_link
+
+    async def _query(self, endpoint, kwargs):
+        """Resolve `lean`, `columns` and `annotations` like DynamicsClient._query, off the event loop."""
+        return await asyncio.to_thread(self.dc._query, endpoint, kwargs)
+
+    async def iter_pages(self, endpoint=None, **kwargs):
+        params, headers = await self._query(endpoint, kwargs)
+        next_link = kwargs.get("next_link")
+        if next_link:
+            data, next_link = await self._get_next_page(next_link, headers=headers)
+        else:
+            data = await self.make_request(endpoint, params=params, headers=headers)
+            next_link = data.get("@odata.nextLink")
+        yield data
+        while next_link:
+            data, next_link = await self._get_next_page(next_link, headers=headers)
+            yield data
+
+    async def iter_records(self, endpoint=None, stream=False, **kwargs):
+        if stream:
+            async for record in self.stream_records(endpoint, **kwargs):
+                yield record
+            return
+        async for page in self.iter_pages(endpoint, **kwargs):
+            for record in page['value']:
+                yield record
+
+    async def _stream_page(self, request_url, decoder, params=None, headers=None):
+        client = self._get_client()
+        limiter, retry = self.dc.limiter, self.dc.retry
+        yielded, attempt, refreshed = 0, 0, False
+        while True:
+            decoder.reset()
+            token = await self.dc.tokens.atoken()
+            request_headers = {**(headers or self.headers), "Authorization": f"Bearer {token}"}
+            await limiter.aacquire()
+            outcome = {}
+            try:
+                async with client.stream("GET", request_url, headers=request_headers, params=params) as response:
+                    outcome = {"status_code": response.status_code, "headers": response.headers}
+                    if response.status_code == 401 and not refreshed:
+                        await asyncio.to_thread(self.dc.tokens.invalidate, token)
+                        refreshed = True
+                        continue
+                    if response.status_code != 200:
+                        await response.aread()
+                        raise_for_response(response, url=request_url)
+                    seen = 0
+                    async for record in aiter_decoded_records(response.aiter_bytes(CHUNK_SIZE), decoder):
+                        seen += 1
+                        if seen > yielded:
+                            yielded += 1
+                            yield record
+                return
+            except httpx.TransportError as e:
+                error = TransientError(str(e), url=request_url)
+            except (ThrottlingError, TransientError) as e:
+                error = e
+            finally:
+                limiter.release(outcome.get("status_code"), outcome.get("headers"))
+            if not retry.should_retry(error, attempt):
+                raise error
+            await asyncio.sleep(retry.delay(attempt, error))
+            attempt += 1
+
+    async def stream_records(self, endpoint=None, **kwargs):
+        params, headers = await self._query(endpoint, kwargs)
+        params = params or None
+        next_link = kwargs.get("next_link")
+        if not next_link:
+            decoder = PageDecoder()
+            async for record in self._stream_page(f"{self.base_url}/{endpoint}", decoder, params, headers):
+                yield record
+            next_link = decoder.next_link
+        while next_link:
+            decoder = PageDecoder()
+            async for record in self._stream_page(next_link, decoder, headers=headers):
+                yield record
+            next_link = decoder.next_link
+
+    async def get_all_records(self, endpoint, **kwargs):
+        return [record async for record in self.iter_records(endpoint, **kwargs)]
+
+    async def get_all_pages(self, endpoint, **kwargs):
+        return [page async for page in self.iter_pages(endpoint, **kwargs)]
+
+    async def iter_partitioned_pages(self, endpoint, primary_key, partitions=4, **kwargs):
+        params = kwargs.get("params") or {}
+        headers = kwargs.get("headers") or self.headers
+        filters = await asyncio.to_thread(self.dc.get_partition_filters, endpoint, primary_key, partitions, params)
+        results = asyncio.Queue(maxsize=max(1, 2 * len(filters)))
+        done = object()
+
+        async def run(index, partition_params):
+            try:
+                async for page in self.iter_pages(endpoint, params=partition_params, headers=headers):
+                    await results.put((index, page))
+                await results.put((index, done))
+            except Exception as e:
+                await results.put((index, e))
+
+        tasks = []
+        for index, partition_filter in enumerate(filters):
+            partition_params = {**params, "$orderby": f"{primary_key} asc"}
+            if partition_filter:
+                partition_params["$filter"] = partition_filter
+            tasks.append(asyncio.create_task(run(index, partition_params)))
+        remaining = len(tasks)
+        try:
+            while remaining:
+                index, item = await results.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield index, item
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
 class DynamicsRequest(DynamicsClient):
@@ -342,7 +831,7 @@ class DynamicsQuery:
     ...
 
 
-def extract_all_entity_pages(dc, logical_name):
+def extract_all_entity_pages(dc, logical_name, checkpoints=None):
     entity_name = logical_name
     try:
         endpoint = dc.get_entity_endpoint(logical_name)
@@ -351,11 +840,11 @@ def extract_all_entity_pages(dc, logical_name):
         print(f"KeyError: {e}")
     print(f"{entity_name}: {endpoint}")
     try:
-        dc.save_entity_pages_to_file(endpoint)
-    except Exception as e:
-        print(f"Error: {e}")
-        pass
-    return
+        dc.save_entity_pages_to_file(endpoint, checkpoints=checkpoints)
+    except DynamicsError as e:
+        print(f"{type(e).__name__} extracting {entity_name} ({e.status_code} {e.url}): {e}")
+        return e
+    return None
 
 
 async def main():
@@ -0,0 +1,109 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+from pathlib import Path
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Manifest:
+    """SQLite manifest of extraction units, claimed by workers under time-limited leases.
+
+    A unit is an entity or one key-range partition of an entity. Claiming
+    takes the largest unit that is pending or whose lease has expired, so
+    a unit held by a crashed worker returns to the pool once its lease
+    runs out. Workers renew their lease while they work. Every process
+    opens its own connection, so a manifest on local disk can be shared by
+    a process pool, and one on a shared filesystem with working locks can
+    be shared by several hosts.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS units ("
+            "key TEXT PRIMARY KEY, entity TEXT NOT NULL, partition INTEGER, partition_filter TEXT, "
+            "pages INTEGER NOT NULL DEFAULT 0, status TEXT NOT NULL DEFAULT 'pending', owner TEXT, "
+            "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, result TEXT, updated REAL)"
+        )
+
+    def _execute(self, query, args=()):
+        return self._connection.execute(query, args)
+
+    def add(self, key, entity, pages=0, partition=None, partition_filter=None):
+        """Add a unit unless it is already in the manifest, so planning twice does not reset progress."""
+        self._execute(
+            "INSERT OR IGNORE INTO units (key, entity, partition, partition_filter, pages, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?)", (key, entity, partition, partition_filter, int(pages or 0), time.time()))
+
+    def claim(self, owner=None):
+        owner = owner or worker_id()
+        now = time.time()
+        self._execute("BEGIN IMMEDIATE")
+        try:
+            row = self._execute(
+                "SELECT * FROM units WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY pages DESC, key LIMIT 1", (PENDING, LEASED, now)).fetchone()
+            if row:
+                self._execute(
+                    "UPDATE units SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "updated = ? WHERE key = ?", (LEASED, owner, now + self.lease_seconds, now, row["key"]))
+            self._execute("COMMIT")
+        except BaseException:
+            self._execute("ROLLBACK")
+            raise
+        return dict(row) if row else None
+
+    def renew(self, key, owner=None):
+        """Extend a lease. Returns False if the unit was reclaimed and is no longer ours."""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE units SET lease_expires = ?, updated = ? WHERE key = ? AND owner = ? AND status = ?",
+            (now + self.lease_seconds, now, key, owner or worker_id(), LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, key, owner=None, result=None):
+        self._execute(
+            "UPDATE units SET status = ?, lease_expires = NULL, result = ?, updated = ? "
+            "WHERE key = ? AND owner = ?", (DONE, json.dumps(result), time.time(), key, owner or worker_id()))
+
+    def fail(self, key, owner=None, error=None):
+        """Release a unit after an error, back to pending until it has used up max_attempts."""
+        self._execute(
+            "UPDATE units SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, "
+            "result = ?, updated = ? WHERE key = ? AND owner = ?",
+            (self.max_attempts, FAILED, PENDING, json.dumps(str(error)), time.time(), key, owner or worker_id()))
+
+    def reclaim(self):
+        """Return units with expired leases to pending and report how many there were."""
+        cursor = self._execute(
+            "UPDATE units SET status = ?, owner = NULL, lease_expires = NULL, updated = ? "
+            "WHERE status = ? AND lease_expires < ?", (PENDING, time.time(), LEASED, time.time()))
+        return cursor.rowcount
+
+    def units(self, status=None):
+        if status:
+            rows = self._execute("SELECT * FROM units WHERE status = ? ORDER BY key", (status,))
+        else:
+            rows = self._execute("SELECT * FROM units ORDER BY key")
+        return [dict(row) for row in rows]
+
+    def summary(self):
+        rows = self._execute("SELECT status, COUNT(*), SUM(pages) FROM units GROUP BY status").fetchall()
+        return {status: {"units": count, "pages": pages or 0} for status, count, pages in rows}
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,93 @@
+import json
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+
+DEFAULT_TTLS = {
+    "entity": timedelta(days=1),
+    "attributes": timedelta(days=1),
+    "endpoint": timedelta(days=7),
+    "record_count": timedelta(hours=1),
+}
+
+
+class MetadataStore:
+    """SQLite-backed metadata cache with one row per (org, kind, key).
+
+    Every row carries its own fetch time, so a single entity, endpoint or
+    count can be refreshed without rewriting anything else. Reads of stale
+    rows are allowed (`fresh_only=False`) so callers can revalidate cheaply
+    instead of downloading everything again.
+    """
+
+    def __init__(self, path=None, ttls=None):
+        self.path = Path(path) if path else Path(__file__).parent / ".metadata.sqlite"
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "org TEXT NOT NULL, kind TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT, fetched_at REAL NOT NULL, PRIMARY KEY (org, kind, key))"
+            )
+
+    def _expiry(self, kind):
+        ttl = self.ttls.get(kind, DEFAULT_TTLS["entity"])
+        return time.time() - ttl.total_seconds()
+
+    def get(self, org, kind, key, fresh_only=True):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, fetched_at FROM metadata WHERE org = ? AND kind = ? AND key = ?",
+                (org, kind, key)).fetchone()
+        if not row or (fresh_only and row[1] < self._expiry(kind)):
+            return None
+        return json.loads(row[0])
+
+    def get_all(self, org, kind, fresh_only=True):
+        query = "SELECT key, value FROM metadata WHERE org = ? AND kind = ?"
+        args = [org, kind]
+        if fresh_only:
+            query += " AND fetched_at >= ?"
+            args.append(self._expiry(kind))
+        with self._lock:
+            rows = self._connection.execute(query, args).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def is_fresh(self, org, kind):
+        with self._lock:
+            oldest, = self._connection.execute(
+                "SELECT MIN(fetched_at) FROM metadata WHERE org = ? AND kind = ?", (org, kind)).fetchone()
+        return oldest is not None and oldest >= self._expiry(kind)
+
+    def put(self, org, kind, key, value):
+        self.put_many(org, kind, {key: value})
+
+    def put_many(self, org, kind, items):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO metadata (org, kind, key, value, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                [(org, kind, key, json.dumps(value), now) for key, value in items.items()])
+
+    def touch(self, org, kind, keys):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "UPDATE metadata SET fetched_at = ? WHERE org = ? AND kind = ? AND key = ?",
+                [(now, org, kind, key) for key in keys])
+
+    def delete(self, org, kind, keys=None):
+        with self._lock, self._connection:
+            if keys is None:
+                self._connection.execute("DELETE FROM metadata WHERE org = ? AND kind = ?", (org, kind))
+            else:
+                self._connection.executemany(
+                    "DELETE FROM metadata WHERE org = ? AND kind = ? AND key = ?",
+                    [(org, kind, key) for key in keys])
+
+    def close(self):
+        self._connection.close()
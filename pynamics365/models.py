@@ -1,19 +1,35 @@
 import json
+from pathlib import Path
 
 import pandas as pd
 
 from pynamics365.client import DynamicsClient
+from pynamics365.endpoints import needs_verification, resolve_endpoint
+from pynamics365.exceptions import raise_for_response
+from pynamics365.frames import iter_dataframes, pages_to_dataframe
+from pynamics365.parquet import ParquetPageWriter
+from pynamics365.partition import iter_concurrently, partition_count, partition_filters
+from pynamics365.records import RecordTable
 
 
 class DynamicsEntity(DynamicsClient):
-    def __init__(self, logical_name, **kwargs):
-        super().__init__(**kwargs)
-
-        self.entity_definition = None
+    def __init__(self, logical_name, retain=True, client=None, entity_definition=None, attributes=None,
+                 per_page=1000, compact=False, **kwargs):
+        if client:
+            kwargs.setdefault("use_cache", client.cache is not None)
+            super().__init__(auth=client.auth, limiter=client.limiter, retry=client.retry, cache=client.cache,
+                             **kwargs)
+            self.session = client.session
+        else:
+            super().__init__(**kwargs)
+        self.client = client or self
+        self.entity_definition = entity_definition
         self.logical_name = logical_name
-        self.endpoint = f"/{self.logical_name}"
-        self.attributes = self.get_attributes()
-        self.per_page = kwargs.get("per_page", 1000)
+        self.endpoint = None
+        self._attributes = attributes
+        self._names = None
+        self._record_count = None
+        self.per_page = per_page
         self.headers = {
             "Authorization": self.auth_token,
             "Content-Type": "application/json",
@@ -21,15 +37,49 @@ class DynamicsEntity(DynamicsClient):
             "OData-MaxVersion": "4.0",
             "OData-Version": "4.0",
         }
-        self.names = self.get_entity_names()
-        self.record_count = self.get_record_count()
-        self.est_pages = (self.record_count // self.per_page) + 1
+        self.retain = retain
+        self.compact = compact
         self.records = None
+        self.pages = None
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._attributes = self.get_attributes()
+        return self._attributes
+
+    @property
+    def names(self):
+        if self._names is None:
+            self.get_entity_names()
+        return self._names
+
+    @names.setter
+    def names(self, names):
+        self._names = names
+
+    @property
+    def record_count(self):
+        if self._record_count is None:
+            self.get_record_count()
+        return self._record_count
+
+    @record_count.setter
+    def record_count(self, record_count):
+        self._record_count = record_count
+
+    @property
+    def est_pages(self):
+        return (self.record_count // self.per_page) + 1
 
     def get_entity_definition(self):
+        definitions = self.client.entity_definitions or {}
+        if self.logical_name in definitions:
+            self.entity_definition = definitions[self.logical_name]
+            return self.entity_definition
         url = f"{self.base_url}/EntityDefinitions(LogicalName='{self.logical_name}')"
         response = self.get(url)
-        response.raise_for_status()
+        raise_for_response(response)
         self.entity_definition = response.json()
         return response.json()
 
@@ -58,83 +108,130 @@ class DynamicsEntity(DynamicsClient):
         ...
 
     def get_endpoint(self):
-        if not self.names:
-            self.get_entity_names()
-        candidate_names = set()
-        for name in self.names.values():
-            candidate_names.add(name.lower())
-            candidate_names.add(name.replace(" ", "").lower())
-        candidate_names = sorted(candidate_names, key=len, reverse=True)
-        for name in candidate_names:
-            url = f"{self.base_url}/{name}"
-            response = self.get(url)
-            if response.status_code == 200:
-                self.endpoint = f"{name}"
-                return self.endpoint
-        return None
+        if not self.entity_definition:
+            self.get_entity_definition()
+        entity_sets = self.client.get_entity_sets() if needs_verification(self.entity_definition) else None
+        self.endpoint = resolve_endpoint(self.entity_definition, entity_sets)
+        return self.endpoint
 
     def get_attributes(self):
         url = f"{self.base_url}/EntityDefinitions(LogicalName='{self.logical_name}')/Attributes"
         response = self.get(url)
-        response.raise_for_status()
+        raise_for_response(response)
         return response.json()['value']
 
     def get_record_count(self):
-        url = f"{self.base_url}/recordcountsnapshots"
-        params = {
-            "$select": "count,lastupdated",
-            "$filter": f"objecttypecode eq {self.entity_definition['ObjectTypeCode']}",
-        }
-        response = self.get(url, params=params)
-        response.raise_for_status()
-        self.record_count = int(response.json()['value'][0]['count'])
+        record_counts = self.client.record_counts or {}
+        if self.logical_name not in record_counts:
+            record_counts = self.client.get_record_counts()
+        record_count = record_counts.get(self.logical_name) or {}
+        self.record_count = int(record_count.get('record_count') or 0)
         return self.record_count
 
-    def get_all_pages(self):
-        page = 1
+    def iter_pages(self, params=None, next_link=None):
         if not self.endpoint:
             self.get_endpoint()
-        url = f"{self.base_url}/{self.endpoint}"
-        response = self.get(url)
-        response.raise_for_status()
-        res_json = response.json()
-        self.pages = [res_json]
-        next_link = res_json.get('@odata.nextLink', None)
+        if not next_link:
+            response = self.get(f"{self.base_url}/{self.endpoint}", params=params)
+            raise_for_response(response)
+            res_json = response.json()
+            yield res_json
+            next_link = res_json.get('@odata.nextLink', None)
         while next_link:
             response = self.get(next_link)
-            response.raise_for_status()
+            raise_for_response(response)
             res_json = response.json()
-            self.pages.append(res_json)
+            yield res_json
             next_link = res_json.get('@odata.nextLink', None)
-        return self.pages
 
-    def get_all_records(self):
-        page = 1
+    def iter_records(self, params=None):
+        for page in self.iter_pages(params=params):
+            yield from page['value']
+
+    def get_all_pages(self):
+        pages = list(self.iter_pages())
+        if self.retain:
+            self.pages = pages
+        return pages
+
+    def get_key_range(self, base_filter=None):
+        primary_key = self.entity_definition['PrimaryIdAttribute']
+        url = f"{self.base_url}/{self.endpoint}"
+        key_range = []
+        for direction in ("asc", "desc"):
+            params = {"$select": primary_key, "$top": 1, "$orderby": f"{primary_key} {direction}"}
+            if base_filter:
+                params["$filter"] = base_filter
+            response = self.get(url, params=params)
+            raise_for_response(response)
+            value = response.json()['value']
+            if not value:
+                return None
+            key_range.append(value[0][primary_key])
+        return tuple(key_range)
+
+    def get_partitioned_pages(self, partitions=None, base_filter=None, max_workers=None):
         if not self.endpoint:
             self.get_endpoint()
-        url = f"{self.base_url}/{self.endpoint}"
-        response = self.get(url)
-        response.raise_for_status()
-        res_json = response.json()
-        self.records = res_json['value']
-        next_link = res_json.get('@odata.nextLink', None)
-        while next_link:
-            response = self.get(next_link)
-            response.raise_for_status()
-            res_json = response.json()
-            self.records.extend(res_json['value'])
-            next_link = res_json.get('@odata.nextLink', None)
-            page += 1
-        return self.records
+        if not self.entity_definition:
+            self.get_entity_definition()
+        primary_key = self.entity_definition['PrimaryIdAttribute']
+        partitions = partitions or partition_count(self.record_count, partition_size=self.per_page * 50)
+        key_range = self.get_key_range(base_filter)
+        if not key_range:
+            return
+        producers = []
+        for partition_filter in partition_filters(primary_key, *key_range, partitions, base_filter=base_filter):
+            params = {"$orderby": f"{primary_key} asc"}
+            if partition_filter:
+                params["$filter"] = partition_filter
+            producers.append(lambda p=params: self.iter_pages(params=p))
+        yield from iter_concurrently(producers, max_workers=max_workers)
+
+    def get_all_records(self, compact=None):
+        compact = self.compact if compact is None else compact
+        if compact:
+            records = RecordTable.from_attributes(self.attributes)
+            records.extend(self.iter_records())
+        else:
+            records = list(self.iter_records())
+        if self.retain:
+            self.records = records
+        return records
+
+    def to_dataframe(self, params=None, columns=None):
+        return pages_to_dataframe(self.iter_pages(params=params), self.attributes, columns)
+
+    def iter_dataframes(self, chunk_pages=10, params=None, columns=None):
+        yield from iter_dataframes(self.iter_pages(params=params), self.attributes, chunk_pages, columns)
+
+    def save_all_pages_to_parquet(self, output_path="../data"):
+        file_path = Path(output_path) / self.logical_name / f"{self.logical_name}.parquet"
+        with ParquetPageWriter(file_path, self.attributes) as writer:
+            for page in self.iter_pages():
+                writer.write_page(page)
+        return file_path
+
+
+def load_entities(client, logical_names=None, **kwargs):
+    """Build DynamicsEntity objects for many tables from one EntityDefinitions snapshot.
+
+    The entities share `client`'s authentication, session and cached record
+    counts, so construction makes no requests of its own.
+    """
+    definitions = client.get_entity_definitions()
+    logical_names = logical_names or list(definitions)
+    return [DynamicsEntity(logical_name, client=client, entity_definition=definitions.get(logical_name), **kwargs)
+            for logical_name in logical_names]
 
 
 class DynamicsExtractor(DynamicsEntity):
-    def __init__(self, **kwargs):
+    def __init__(self, output_path="../data", **kwargs):
         super().__init__(**kwargs)
-        self.output_path = kwargs.get("output_path", "../data")
+        self.output_path = output_path
 
     def save_all_pages(self):
-        ...
+        return self.save_all_pages_to_parquet(self.output_path)
 
 
 def main():
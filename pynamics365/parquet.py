@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from pynamics365.schema import attribute_columns
+
+
+def _arrow_type(attribute_type):
+    return {
+        "BigInt": pa.int64(),
+        "Integer": pa.int32(),
+        "Picklist": pa.int32(),
+        "State": pa.int32(),
+        "Status": pa.int32(),
+        "Boolean": pa.bool_(),
+        "Double": pa.float64(),
+        "Decimal": pa.float64(),
+        "Money": pa.float64(),
+        "DateTime": pa.timestamp("ms", tz="UTC"),
+    }.get(attribute_type, pa.string())
+
+
+def _parse_datetime(value):
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _converter(arrow_type):
+    if pa.types.is_timestamp(arrow_type):
+        return lambda v: _parse_datetime(v) if isinstance(v, str) else v
+    if pa.types.is_string(arrow_type):
+        return lambda v: v if v is None or isinstance(v, str) else str(v)
+    return lambda v: v
+
+
+def arrow_schema(attributes):
+    if pa is None:
+        raise ImportError("pyarrow is required for Parquet output: pip install 'pynamics365[parquet]'")
+    return pa.schema([pa.field(column, _arrow_type(attribute_type))
+                      for column, attribute_type in attribute_columns(attributes)])
+
+
+class ParquetPageWriter:
+    """Write extracted pages to one Parquet file with a schema taken from Attributes metadata.
+
+    Records are buffered only until `row_group_size` rows are collected, so an
+    entity of any size is written in bounded memory. Keys that are not
+    attribute columns (annotations, navigation links) are dropped.
+    """
+
+    def __init__(self, path, attributes, row_group_size=50000, compression="snappy"):
+        self.schema = arrow_schema(attributes)
+        self.converters = [(field.name, _converter(field.type)) for field in self.schema]
+        self.row_group_size = row_group_size
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.writer = pq.ParquetWriter(self.path, self.schema, compression=compression)
+        self.columns = {name: [] for name, _ in self.converters}
+        self.buffered = 0
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_page(self, page):
+        records = page['value'] if isinstance(page, dict) else page
+        for name, convert in self.converters:
+            self.columns[name].extend(convert(record.get(name)) for record in records)
+        self.buffered += len(records)
+        if self.buffered >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        arrays = [pa.array(self.columns[field.name], type=field.type) for field in self.schema]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows_written += self.buffered
+        self.columns = {name: [] for name, _ in self.converters}
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
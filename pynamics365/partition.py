@@ -0,0 +1,102 @@
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+
+# SQL Server compares uniqueidentifiers by byte groups of the stored (little
+# endian) value, starting from the last group. Keys are mapped onto integers in
+# that order so that evenly spaced integers become evenly spaced $filter bounds.
+SQL_GUID_BYTE_ORDER = [10, 11, 12, 13, 14, 15, 8, 9, 6, 7, 4, 5, 0, 1, 2, 3]
+
+
+def guid_to_key(guid):
+    raw = uuid.UUID(str(guid)).bytes_le
+    return int.from_bytes(bytes(raw[i] for i in SQL_GUID_BYTE_ORDER), "big")
+
+
+def key_to_guid(key):
+    ordered = key.to_bytes(16, "big")
+    raw = bytearray(16)
+    for position, i in enumerate(SQL_GUID_BYTE_ORDER):
+        raw[i] = ordered[position]
+    return str(uuid.UUID(bytes_le=bytes(raw)))
+
+
+def partition_count(record_count, partition_size=50000, max_partitions=16):
+    if not record_count:
+        return 1
+    return max(1, min(max_partitions, ceil(int(record_count) / partition_size)))
+
+
+def guid_boundaries(min_guid, max_guid, partitions):
+    low, high = guid_to_key(min_guid), guid_to_key(max_guid)
+    step = (high - low) / partitions
+    boundaries = []
+    for i in range(1, partitions):
+        boundary = key_to_guid(low + int(step * i))
+        if boundary not in boundaries and guid_to_key(boundary) > low:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def partition_filters(primary_key, min_guid, max_guid, partitions, base_filter=None):
+    """Split [min_guid, max_guid] into disjoint, exhaustive `$filter` ranges."""
+    bounds = [None, *guid_boundaries(min_guid, max_guid, partitions), None]
+    filters = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        clauses = [f"({base_filter})"] if base_filter else []
+        if lower:
+            clauses.append(f"{primary_key} ge {lower}")
+        if upper:
+            clauses.append(f"{primary_key} lt {upper}")
+        filters.append(" and ".join(clauses) or None)
+    return filters
+
+
+def iter_concurrently(producers, max_workers=None, buffer=2):
+    """Run each producer's iterator on a thread and yield `(index, item)`.
+
+    Items from one producer are yielded in the order it produced them. The
+    shared queue is bounded so producers block instead of buffering a whole
+    entity when the consumer falls behind.
+    """
+    results = queue.Queue(maxsize=max(1, len(producers) * buffer))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(index, producer):
+        try:
+            for item in producer():
+                if not put((index, item)):
+                    return
+            put((index, done))
+        except BaseException as e:
+            put((index, e))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(producers) or 1) as executor:
+        for index, producer in enumerate(producers):
+            executor.submit(run, index, producer)
+        remaining = len(producers)
+        try:
+            while remaining:
+                index, item = results.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield index, item
+        finally:
+            stop.set()
+            while not results.empty():
+                results.get_nowait()
@@ -0,0 +1,209 @@
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+
+from pynamics365.schema import attribute_columns
+
+TYPECODES = {
+    "BigInt": "q",
+    "Integer": "q",
+    "Picklist": "q",
+    "State": "q",
+    "Status": "q",
+    "Boolean": "b",
+    "Double": "d",
+    "Decimal": "d",
+    "Money": "d",
+}
+
+VALUE_TYPECODES = {bool: "b", int: "q", float: "d"}
+
+VALUE, NULL, ABSENT = 0, 1, 2
+_ABSENT = object()
+
+
+class _Fallback(Exception):
+    pass
+
+
+class _TypedColumn:
+    """Numbers in a typed array, with a byte per row telling a value from null or a missing key."""
+
+    def __init__(self, typecode, rows=0):
+        self.values = array(typecode, bytes(array(typecode).itemsize * rows))
+        self.state = bytearray([ABSENT]) * rows
+        self.is_bool = typecode == "b"
+
+    def append(self, value, state=VALUE):
+        if state != VALUE or value is None:
+            self.values.append(0)
+            self.state.append(state if state != VALUE else NULL)
+            return
+        if isinstance(value, bool) != self.is_bool:
+            raise _Fallback
+        try:
+            self.values.append(value)
+        except (TypeError, OverflowError):
+            raise _Fallback
+        self.state.append(VALUE)
+
+    def get(self, index):
+        state = self.state[index]
+        if state != VALUE:
+            return state, None
+        value = self.values[index]
+        return VALUE, bool(value) if self.is_bool else value
+
+    def __len__(self):
+        return len(self.state)
+
+    @property
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + len(self.state)
+
+
+class _ObjectColumn:
+    """Any other values in a list, with strings interned so repeated GUIDs and labels share one object."""
+
+    def __init__(self, rows=0):
+        self.values = [_ABSENT] * rows
+
+    def append(self, value, state=VALUE):
+        if state == ABSENT:
+            value = _ABSENT
+        elif isinstance(value, str):
+            value = sys.intern(value)
+        self.values.append(value)
+
+    def get(self, index):
+        value = self.values[index]
+        if value is _ABSENT:
+            return ABSENT, None
+        return (NULL if value is None else VALUE), value
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return 8 * len(self.values)
+
+
+class Row(Mapping):
+    """A read-only dict-like view of one row of a RecordTable."""
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        column = self._table.columns.get(key)
+        if column is None:
+            raise KeyError(key)
+        state, value = column.get(self._index)
+        if state == ABSENT:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        for name, column in self._table.columns.items():
+            if column.get(self._index)[0] != ABSENT:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Row({dict(self)!r})"
+
+    def to_dict(self):
+        return dict(self)
+
+
+class RecordTable(Sequence):
+    """Columnar store for extracted records that still reads like a list of dicts.
+
+    Integers, floats and booleans are kept in typed arrays, typed from
+    Attributes metadata or, for keys not in it, from the first value seen.
+    Other values are kept in a list per column, with strings interned so
+    each distinct value is held once. A typed column that meets a value it
+    cannot hold falls back to a list. Keys are stored once per table, not
+    once per row. Indexing returns lazy Row views, and missing keys stay
+    missing rather than turning into None.
+    """
+
+    def __init__(self, column_types=None):
+        self.column_types = dict(column_types or {})
+        self.columns = {}
+        self.rows = 0
+        for name, attribute_type in self.column_types.items():
+            self.columns[name] = self._new_column(attribute_type)
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        return cls(attribute_columns(attributes))
+
+    def _new_column(self, attribute_type=None, rows=0, value=None):
+        typecode = TYPECODES.get(attribute_type) or VALUE_TYPECODES.get(type(value))
+        return _TypedColumn(typecode, rows) if typecode else _ObjectColumn(rows)
+
+    def _to_objects(self, name):
+        typed = self.columns[name]
+        column = _ObjectColumn()
+        for index in range(len(typed)):
+            state, value = typed.get(index)
+            column.append(value, state)
+        self.columns[name] = column
+        return column
+
+    def append(self, record):
+        for name in record:
+            if name not in self.columns:
+                self.columns[name] = self._new_column(rows=self.rows, value=record[name])
+        for name, column in self.columns.items():
+            if name in record:
+                try:
+                    column.append(record[name])
+                except _Fallback:
+                    self._to_objects(name).append(record[name])
+            else:
+                column.append(None, ABSENT)
+        self.rows += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def extend_pages(self, pages):
+        for page in pages:
+            self.extend(page['value'])
+        return self
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Row(self, i) for i in range(*index.indices(self.rows))]
+        if index < 0:
+            index += self.rows
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        return Row(self, index)
+
+    def __repr__(self):
+        return f"RecordTable<{self.rows} rows, {len(self.columns)} columns>"
+
+    def column(self, name):
+        column = self.columns[name]
+        return [column.get(index)[1] for index in range(self.rows)]
+
+    def to_records(self):
+        return [dict(row) for row in self]
+
+    @property
+    def nbytes(self):
+        """Approximate size of the row storage, excluding the values held by object columns."""
+        return sum(column.nbytes for column in self.columns.values())
@@ -0,0 +1,90 @@
+import asyncio
+import random
+import threading
+import time
+
+from pynamics365.exceptions import ThrottlingError, TransientError
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE", "OPTIONS")
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter and a shared retry budget.
+
+    Attempt `n` sleeps a random time between 0 and `min(cap, base * 2 ** n)`,
+    or for the Retry-After the service asked for. Each success adds
+    `budget_ratio` of a retry to the budget, up to `budget`, and each
+    transient retry spends one, so a sustained outage fails fast instead of
+    multiplying the load while single blips are absorbed. Throttled
+    requests were never executed and are retried for any method, up to
+    `max_throttled_attempts`, without spending the budget. Throttling is
+    the service pacing a long extract, not a sign that it is down. Other
+    transient failures are only retried for idempotent methods.
+    """
+
+    def __init__(self, max_attempts=5, base=1.0, cap=60.0, budget=20, budget_ratio=0.1, max_throttled_attempts=10):
+        self.max_attempts = max_attempts
+        self.max_throttled_attempts = max_throttled_attempts
+        self.base = base
+        self.cap = cap
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.balance = float(budget)
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt, error=None):
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    def should_retry(self, error, attempt, method="GET"):
+        if isinstance(error, ThrottlingError):
+            if attempt + 1 >= self.max_throttled_attempts:
+                return False
+            with self._lock:
+                self.retries += 1
+            return True
+        if attempt + 1 >= self.max_attempts:
+            return False
+        if not isinstance(error, TransientError) or method.upper() not in IDEMPOTENT_METHODS:
+            return False
+        with self._lock:
+            if self.balance < 1:
+                return False
+            self.balance -= 1
+            self.retries += 1
+        return True
+
+    def succeeded(self):
+        with self._lock:
+            self.balance = min(self.budget, self.balance + self.budget_ratio)
+
+    def call(self, fn, method="GET"):
+        attempt = 0
+        while True:
+            try:
+                result = fn()
+            except (ThrottlingError, TransientError) as e:
+                if not self.should_retry(e, attempt, method):
+                    raise
+                time.sleep(self.delay(attempt, e))
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
+
+    async def acall(self, fn, method="GET"):
+        attempt = 0
+        while True:
+            try:
+                result = await fn()
+            except (ThrottlingError, TransientError) as e:
+                if not self.should_retry(e, attempt, method):
+                    raise
+                await asyncio.sleep(self.delay(attempt, e))
+                attempt += 1
+                continue
+            self.succeeded()
+            return result
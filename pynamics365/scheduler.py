@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from math import ceil
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """One unit of extraction work, usually an entity or a partition of one.
+
+    `run()` does the work and may return the number of pages it fetched.
+    `weight` scales the cost of a page, e.g. for very wide entities. An
+    optional `split(parts)` returns jobs that together do the same work, and
+    the scheduler uses it to break up a job that would otherwise finish long
+    after everything else.
+    """
+
+    def __init__(self, key, pages, run, weight=1.0, split=None):
+        self.key = key
+        self.pages = max(1, int(pages or 0))
+        self.run = run
+        self.weight = weight
+        self.split = split
+        self.result = None
+        self.error = None
+        self.seconds = None
+
+    def __repr__(self):
+        return f"Job<{self.key}, pages={self.pages}>"
+
+    @property
+    def work(self):
+        return self.pages * self.weight
+
+
+class Scheduler:
+    """Longest-processing-time-first scheduling over a fixed pool of workers.
+
+    Pending jobs are started largest first, so the long ones overlap with
+    everything else instead of running alone at the end. Seconds per page
+    are re-estimated from every finished job. Before a job starts, it is
+    split if its estimate exceeds both `min_split_seconds` and an even
+    share of the remaining work. The wall-clock time then approaches total
+    work divided by workers. Splitting may itself make requests, so it runs
+    on a worker, and a job whose split fails runs whole instead.
+    """
+
+    def __init__(self, workers=4, seconds_per_page=0.5, min_split_seconds=300, max_split=16, smoothing=0.2):
+        self.workers = workers
+        self.seconds_per_page = seconds_per_page
+        self.min_split_seconds = min_split_seconds
+        self.max_split = max_split
+        self.smoothing = smoothing
+        self.jobs = {}
+        self._pending = []
+        self._running = {}
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, job):
+        with self._lock:
+            self.jobs[job.key] = job
+            heapq.heappush(self._pending, (-job.work, next(self._order), job))
+        return job
+
+    def estimate(self, job):
+        return job.work * self.seconds_per_page
+
+    def remaining_seconds(self):
+        """Estimated wall-clock seconds left, assuming the pool stays busy."""
+        with self._lock:
+            pending = sum(self.estimate(job) for _, _, job in self._pending)
+            running = sum(max(0.0, self.estimate(job) - (time.monotonic() - started))
+                          for job, started in self._running.values())
+        return (pending + running) / self.workers
+
+    def _parts(self, job):
+        if not job.split:
+            return 1
+        total = sum(self.estimate(j) for _, _, j in self._pending) + self.estimate(job)
+        target = max(self.min_split_seconds, total / self.workers)
+        if self.estimate(job) <= target:
+            return 1
+        return min(self.max_split, ceil(self.estimate(job) / target))
+
+    def _next(self):
+        """Pop the largest pending job and return it with the number of parts it should be split into."""
+        if not self._pending:
+            return None, 1
+        _, _, job = heapq.heappop(self._pending)
+        return job, self._parts(job)
+
+    def _split(self, job, parts):
+        try:
+            return job.split(parts) or []
+        except Exception as e:
+            logger.warning(f"Could not split {job.key}, running it whole: {e!r}")
+            return []
+
+    def _replace(self, job, split_jobs):
+        if not split_jobs:
+            job.split = None
+            heapq.heappush(self._pending, (-job.work, next(self._order), job))
+            return
+        logger.debug(f"Split {job.key} into {len(split_jobs)} jobs")
+        del self.jobs[job.key]
+        for split_job in split_jobs:
+            self.jobs[split_job.key] = split_job
+            heapq.heappush(self._pending, (-split_job.work, next(self._order), split_job))
+
+    def _record(self, job, started):
+        job.seconds = time.monotonic() - started
+        if job.error:
+            logger.error(f"{job.key} failed after {job.seconds:.1f}s: {job.error!r}")
+        else:
+            pages = job.result if isinstance(job.result, int) and job.result > 0 else job.pages
+            observed = job.seconds / (pages * job.weight)
+            self.seconds_per_page += self.smoothing * (observed - self.seconds_per_page)
+            logger.debug(f"{job.key} finished {pages} pages in {job.seconds:.1f}s, "
+                         f"{self.seconds_per_page:.2f}s/page, about {self.remaining_seconds():.0f}s left")
+
+    def _execute(self, job):
+        try:
+            job.result = job.run()
+        except Exception as e:
+            job.error = e
+        return job
+
+    def run(self):
+        """Run every job and return them by key. A failed job keeps its exception in `error`."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {}
+            while True:
+                with self._lock:
+                    while len(futures) < self.workers:
+                        job, parts = self._next()
+                        if job is None:
+                            break
+                        if parts > 1:
+                            futures[executor.submit(self._split, job, parts)] = (job, None)
+                            continue
+                        started = time.monotonic()
+                        self._running[job.key] = (job, started)
+                        futures[executor.submit(self._execute, job)] = (job, started)
+                if not futures:
+                    break
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    job, started = futures.pop(future)
+                    if started is None:
+                        with self._lock:
+                            self._replace(job, future.result())
+                        continue
+                    future.result()
+                    with self._lock:
+                        del self._running[job.key]
+                    self._record(job, started)
+        return self.jobs
@@ -0,0 +1,73 @@
+import re
+
+LOOKUP_TYPES = {"Lookup", "Owner", "Customer"}
+UNREADABLE_TYPES = {"Virtual", "PartyList", "CalendarRules", "ManagedProperty", "EntityName"}
+
+
+def attribute_type(attribute):
+    type_name = (attribute.get("AttributeTypeName") or {}).get("Value")
+    if type_name == "MultiSelectPicklistType":
+        return "MultiSelectPicklist"
+    return attribute.get("AttributeType")
+
+
+def column_name(attribute):
+    if attribute.get("AttributeType") in LOOKUP_TYPES:
+        return f"_{attribute['LogicalName']}_value"
+    return attribute["LogicalName"]
+
+
+def is_readable(attribute):
+    if attribute.get("IsValidForRead") is False or attribute.get("AttributeOf"):
+        return False
+    return attribute_type(attribute) not in UNREADABLE_TYPES
+
+
+def attribute_columns(attributes):
+    """Map Attributes metadata to the `(column, attribute_type)` pairs a record carries."""
+    columns = {}
+    for attribute in attributes or []:
+        if is_readable(attribute):
+            columns.setdefault(column_name(attribute), attribute_type(attribute))
+    return list(columns.items())
+
+
+ANNOTATIONS = {
+    "formatted": "OData.Community.Display.V1.FormattedValue",
+    "lookup": "Microsoft.Dynamics.CRM.lookuplogicalname",
+    "navigation": "Microsoft.Dynamics.CRM.associatednavigationproperty",
+}
+LEAN_ANNOTATIONS = ("lookup",)
+
+
+def select_clause(attributes, columns=None):
+    """Build `$select` from the readable attributes, optionally limited to `columns`.
+
+    `columns` may name attributes by logical name or by the column the
+    record carries, so both `ownerid` and `_ownerid_value` select the lookup.
+    """
+    selected = []
+    for attribute in attributes or []:
+        if not is_readable(attribute):
+            continue
+        column = column_name(attribute)
+        if columns is None or column in columns or attribute["LogicalName"] in columns:
+            selected.append(column)
+    return ",".join(dict.fromkeys(selected))
+
+
+def prefer_page_size(prefer, default=1000):
+    """Return the `odata.maxpagesize` of a Prefer header, or `default` when it has none."""
+    match = re.search(r"odata\.maxpagesize=(\d+)", prefer or "")
+    return int(match.group(1)) if match else default
+
+
+def prefer_header(annotations=LEAN_ANNOTATIONS, page_size=1000):
+    """Build a Prefer header asking only for the given annotation families (keys of ANNOTATIONS or full names)."""
+    preferences = []
+    if annotations:
+        names = ",".join(ANNOTATIONS.get(a, a) for a in annotations)
+        preferences.append(f'odata.include-annotations="{names}"')
+    if page_size:
+        preferences.append(f"odata.maxpagesize={page_size}")
+    return ",".join(preferences)
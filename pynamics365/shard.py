@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil
+from pathlib import Path
+
+from pynamics365.checkpoint import CheckpointStore
+from pynamics365.entity import DynamicsEntityExtractor
+from pynamics365.main import DynamicsClient
+from pynamics365.manifest import Manifest, worker_id
+
+logger = logging.getLogger(__name__)
+
+
+def plan(dc, manifest, logical_names=None, partition_pages=500, max_partitions=16):
+    """Add a unit per entity to `manifest`, splitting entities over `partition_pages` into key ranges."""
+    entities = dc.get_entity_list()
+    if dc.record_counts is None:
+        dc.get_record_counts()
+    added = 0
+    for logical_name in logical_names or [name for name in entities if name]:
+        de = DynamicsEntityExtractor(dc, **entities[logical_name])
+        if not de.endpoint:
+            continue
+        pages = de.estimated_pages or 0
+        parts = min(max_partitions, ceil(pages / partition_pages))
+        primary_key = de.entity_record.get("PrimaryIdAttribute")
+        filters = dc.get_partition_filters(de.endpoint, primary_key, parts) if parts > 1 and primary_key else []
+        if len(filters) > 1:
+            for partition, partition_filter in enumerate(filters):
+                manifest.add(f"{logical_name}[{partition + 1}/{len(filters)}]", logical_name,
+                             ceil(pages / len(filters)), partition, partition_filter)
+                added += 1
+        else:
+            manifest.add(logical_name, logical_name, pages)
+            added += 1
+    return added
+
+
+def _heartbeat(manifest_path, key, owner, lease_seconds, stop):
+    manifest = Manifest(manifest_path, lease_seconds)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not manifest.renew(key, owner):
+                logger.warning(f"Lost the lease on {key}")
+                return
+    finally:
+        manifest.close()
+
+
+def run_worker(manifest_path, output_dir="../data", lease_seconds=300, **kwargs):
+    """Claim and extract units from the manifest until none are left, returning the number completed."""
+    manifest = Manifest(manifest_path, lease_seconds)
+    dc = DynamicsClient(**kwargs)
+    entities = dc.get_entity_list()
+    checkpoints = CheckpointStore(Path(output_dir) / ".checkpoints")
+    owner = worker_id()
+    completed = 0
+    try:
+        while True:
+            unit = manifest.claim(owner)
+            if unit is None:
+                return completed
+            key = unit["key"]
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat, args=(manifest_path, key, owner, lease_seconds, stop),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                de = DynamicsEntityExtractor(dc, retain=False, **entities[unit["entity"]])
+                if unit["partition"] is not None:
+                    pages = de.save_partition_to_json(output_dir, unit["partition"], unit["partition_filter"])
+                else:
+                    pages = de.save_all_pages_to_json(output_dir, checkpoints=checkpoints)
+            except Exception as e:
+                logger.error(f"{owner} failed {key} (attempt {unit['attempts'] + 1}): {e!r}")
+                manifest.fail(key, owner, e)
+            else:
+                manifest.complete(key, owner, {"pages": pages})
+                completed += 1
+                logger.debug(f"{owner} completed {key}, {pages} pages")
+            finally:
+                stop.set()
+                heartbeat.join()
+    finally:
+        manifest.close()
+
+
+def run_pool(manifest_path, processes=None, output_dir="../data", lease_seconds=300, **kwargs):
+    """Run one worker per process against the same manifest and return the units each completed.
+
+    JSON decoding and encoding is CPU-bound, so one process saturates a core
+    well before the API limits. More hosts can join by running `run_worker`
+    against the same manifest.
+    """
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(run_worker, manifest_path, output_dir, lease_seconds, **kwargs)
+                   for _ in range(processes)]
+        return [future.result() for future in futures]
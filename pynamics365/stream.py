@@ -0,0 +1,157 @@
+import codecs
+import json
+from json.decoder import WHITESPACE
+
+CHUNK_SIZE = 64 * 1024
+
+
+class PageDecoder:
+    """Incremental decoder for a single OData collection response.
+
+    Feed it raw chunks as they arrive. Each call returns the records of the
+    `value` array that are complete so far, and top-level properties such as
+    `@odata.nextLink` are available on the decoder as soon as they have been
+    read.
+    """
+
+    def __init__(self, encoding="utf-8"):
+        self.encoding = encoding
+        self._text = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buffer = ""
+        self._pos = 0
+        self._state = "start"
+        self._key = None
+        self.properties = {}
+        self.record_count = 0
+
+    def reset(self):
+        """Forget everything read so far, so the page can be decoded again from its first byte."""
+        self.__init__(self.encoding)
+
+    @property
+    def next_link(self):
+        return self.properties.get("@odata.nextLink")
+
+    @property
+    def done(self):
+        return self._state == "end"
+
+    def feed(self, data, final=False):
+        if isinstance(data, bytes):
+            data = self._text.decode(data, final=final)
+        if self._pos > CHUNK_SIZE:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        self._buffer += data
+        records = self._parse(final)
+        self.record_count += len(records)
+        return records
+
+    def close(self):
+        records = self.feed(b"", final=True)
+        if self._state != "end":
+            raise json.JSONDecodeError("Unexpected end of page", self._buffer, len(self._buffer))
+        return records
+
+    def _skip(self):
+        self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+        return self._buffer[self._pos:self._pos + 1]
+
+    def _expect(self, char):
+        if self._skip() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self._buffer, self._pos)
+        self._pos += 1
+
+    def _decode(self, final):
+        self._skip()
+        try:
+            value, end = self._json.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        # A number at the very end of the buffer may still be missing digits.
+        if end == len(self._buffer) and not final:
+            return False, None
+        self._pos = end
+        return True, value
+
+    def _parse(self, final):
+        records = []
+        while True:
+            state = self._state
+            if state == "end":
+                return records
+            if not self._skip():
+                return records
+            if state == "start":
+                self._expect("{")
+                self._state = "first_key"
+            elif state in ("first_key", "key"):
+                if state == "first_key" and self._skip() == "}":
+                    self._pos += 1
+                    self._state = "end"
+                    continue
+                complete, self._key = self._decode(final)
+                if not complete:
+                    return records
+                self._state = "colon"
+            elif state == "colon":
+                self._expect(":")
+                self._state = "array" if self._key == "value" else "property"
+            elif state == "array":
+                if self._skip() != "[":
+                    self._state = "property"
+                    continue
+                self._pos += 1
+                self._state = "first_item"
+            elif state == "first_item" and self._skip() == "]":
+                self._pos += 1
+                self._state = "next_key"
+            elif state in ("first_item", "item"):
+                complete, record = self._decode(final)
+                if not complete:
+                    return records
+                records.append(record)
+                self._state = "next_item"
+            elif state == "next_item":
+                char = self._skip()
+                self._pos += 1
+                if char == ",":
+                    self._state = "item"
+                elif char == "]":
+                    self._state = "next_key"
+                else:
+                    raise json.JSONDecodeError("Expecting ',' or ']'", self._buffer, self._pos - 1)
+            elif state == "property":
+                complete, value = self._decode(final)
+                if not complete:
+                    return records
+                self.properties[self._key] = value
+                self._state = "next_key"
+            elif state == "next_key":
+                char = self._skip()
+                self._pos += 1
+                if char == ",":
+                    self._state = "key"
+                elif char == "}":
+                    self._state = "end"
+                else:
+                    raise json.JSONDecodeError("Expecting ',' or '}'", self._buffer, self._pos - 1)
+
+
+def iter_decoded_records(chunks, decoder=None):
+    decoder = decoder or PageDecoder()
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+    yield from decoder.close()
+
+
+async def aiter_decoded_records(chunks, decoder=None):
+    decoder = decoder or PageDecoder()
+    async for chunk in chunks:
+        for record in decoder.feed(chunk):
+            yield record
+    for record in decoder.close():
+        yield record
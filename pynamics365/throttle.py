@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+
+THROTTLED_STATUS = (429, 503)
+BURST_REMAINING = "x-ms-ratelimit-burst-remaining-xrm-requests"
+TIME_REMAINING = "x-ms-ratelimit-time-remaining-xrm-requests"
+
+
+def retry_after(headers, default=None):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return default
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit fed by Dataverse service protection signals.
+
+    Every successful response raises the limit by `increase / limit`, which
+    works out to about `increase` per round of requests. A 429/503 response,
+    or a remaining-requests header below `low_remaining`, multiplies the limit
+    by `decrease`, at most once per `cooldown` seconds. A Retry-After header
+    also pauses new requests until it has passed. The limiter can be shared
+    by threads and asyncio tasks, so one instance caps a whole process.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=52, increase=1.0, decrease=0.5, low_remaining=500,
+                 cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.low_remaining = low_remaining
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.successes = 0
+        self.throttled = 0
+        self.remaining_requests = None
+        self.remaining_time = None
+        self._cond = threading.Condition()
+        self._waiters = []
+
+    def limits(self):
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "target": round(self.limit, 2),
+                "minimum": self.minimum,
+                "maximum": self.maximum,
+                "in_flight": self.in_flight,
+                "blocked_for": max(0.0, round(self.blocked_until - time.monotonic(), 2)),
+                "successes": self.successes,
+                "throttled": self.throttled,
+                "remaining_requests": self.remaining_requests,
+                "remaining_time": self.remaining_time,
+            }
+
+    def _try_acquire(self):
+        """Take a slot and return 0, or return how long to wait (None if until a release)."""
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.in_flight < max(self.minimum, int(self.limit)):
+            self.in_flight += 1
+            return 0
+        return None
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self._cond.wait(timeout=wait)
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            try:
+                await asyncio.wait_for(waiter, timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, status_code=None, headers=None):
+        with self._cond:
+            self.in_flight -= 1
+            if status_code is not None:
+                self._feedback(status_code, headers or {})
+            self._cond.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        outcome = {}
+        try:
+            yield outcome
+        finally:
+            self.release(outcome.get("status_code"), outcome.get("headers"))
+
+    def _feedback(self, status_code, headers):
+        now = time.monotonic()
+        # Each response reports its own budget, so one without the headers clears the last reading.
+        remaining, remaining_time = headers.get(BURST_REMAINING), headers.get(TIME_REMAINING)
+        self.remaining_requests = int(remaining) if remaining is not None else None
+        self.remaining_time = float(remaining_time) if remaining_time is not None else None
+        throttled = status_code in THROTTLED_STATUS
+        if throttled:
+            self.throttled += 1
+            self.blocked_until = max(self.blocked_until, now + retry_after(headers, 0))
+        if throttled or (self.remaining_requests is not None and self.remaining_requests < self.low_remaining):
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self.last_decrease = now
+        elif 200 <= status_code < 400:
+            self.successes += 1
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from benchmarks.mock_server import MockDataverse
+
+LOGICAL_NAME = "new_widget"
+RECORDS = 230
+PAGE_SIZE = 50
+
+
+@pytest.fixture(scope="session")
+def server():
+    with MockDataverse({LOGICAL_NAME: RECORDS}, columns=6) as server:
+        yield server
+
+
+@pytest.fixture
+def dc(server, tmp_path):
+    from pynamics365.main import DynamicsClient
+    dc = DynamicsClient(**server.client_kwargs(), token_path=tmp_path / "token.json",
+                        metadata_path=tmp_path / "metadata.sqlite", cache_path=tmp_path / "cache.sqlite")
+    dc.headers["Prefer"] = f'odata.include-annotations="*",odata.maxpagesize={PAGE_SIZE}'
+    return dc
+
+
+@pytest.fixture
+def make_extractor(dc):
+    from pynamics365.entity import DynamicsEntityExtractor
+
+    def make(**kwargs):
+        return DynamicsEntityExtractor(dc, **kwargs, **dc.get_entity_list()[LOGICAL_NAME])
+
+    return make
+
+
+def saved_records(output_dir):
+    """Every record in the page files written for the test entity."""
+    records = []
+    for filename in sorted((output_dir / LOGICAL_NAME).glob(f"{LOGICAL_NAME}_extract_*page_*.json")):
+        records += json.loads(filename.read_text())['value']
+    return records
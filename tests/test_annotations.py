@@ -0,0 +1,53 @@
+import asyncio
+
+from pynamics365.annotations import FORMATTED_VALUE, LOOKUP_LOGICAL_NAME, NAVIGATION_PROPERTY, AnnotationSplitter
+from pynamics365.checkpoint import CheckpointStore
+
+from tests.conftest import LOGICAL_NAME, PAGE_SIZE, RECORDS, saved_records
+from tests.test_resume import crash_after
+
+ANNOTATIONS = (FORMATTED_VALUE, LOOKUP_LOGICAL_NAME, NAVIGATION_PROPERTY)
+
+
+def assert_labels_restored(server, dc, output_dir, count=RECORDS):
+    """Joining the saved dictionaries back onto the saved records must give the records as served."""
+    primary_key = server.entity(LOGICAL_NAME).primary_key
+    served = {record[primary_key]: record for record in dc.get_all_records(server.entity(LOGICAL_NAME).entity_set)}
+    splitter = AnnotationSplitter.load(output_dir / LOGICAL_NAME / f"{LOGICAL_NAME}_annotations.json")
+    records = saved_records(output_dir)
+    assert len(records) == count
+    assert any(f"{key}@{FORMATTED_VALUE}" in served[record[primary_key]] and f"{key}@{FORMATTED_VALUE}" not in record
+               for record in records for key in record)
+    for record in records:
+        assert splitter.join(record, ANNOTATIONS) == served[record[primary_key]]
+
+
+def test_async_save_writes_annotations(server, dc, make_extractor, tmp_path):
+    output_dir = tmp_path / "output"
+    extractor = make_extractor(split_annotations=True)
+
+    async def extract():
+        try:
+            await extractor.asave_all_pages_to_json(output_dir)
+        finally:
+            await dc.aclient.aclose()
+
+    asyncio.run(extract())
+    assert_labels_restored(server, dc, output_dir)
+
+
+def test_resumed_save_keeps_labels_of_earlier_pages(server, dc, make_extractor, tmp_path):
+    output_dir, checkpoints = tmp_path / "output", CheckpointStore(tmp_path / "checkpoints")
+    extractor = make_extractor(split_annotations=True)
+    crash_after(extractor, 2)
+    try:
+        extractor.save_all_pages_to_json(output_dir, checkpoints=checkpoints)
+    except RuntimeError:
+        pass
+    # The labels stripped from the committed pages are on disk before the resume.
+    assert_labels_restored(server, dc, output_dir, count=2 * PAGE_SIZE)
+
+    make_extractor(split_annotations=True).save_all_pages_to_json(output_dir, checkpoints=checkpoints)
+
+    assert checkpoints.is_complete(LOGICAL_NAME)
+    assert_labels_restored(server, dc, output_dir)
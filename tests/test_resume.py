@@ -0,0 +1,74 @@
+from pynamics365.checkpoint import CheckpointStore
+
+from tests.conftest import LOGICAL_NAME, RECORDS, saved_records
+
+
+def crash_after(extractor, pages):
+    """Make `extractor` fail after yielding `pages` pages, as a killed run would."""
+    get_all_pages = extractor.get_all_pages
+
+    def crashing(**kwargs):
+        for number, page in enumerate(get_all_pages(**kwargs)):
+            if number == pages:
+                raise RuntimeError("crashed")
+            yield page
+
+    extractor.get_all_pages = crashing
+
+
+def assert_saved_once(output_dir, server):
+    keys = [record[server.entity(LOGICAL_NAME).primary_key] for record in saved_records(output_dir)]
+    assert len(keys) == RECORDS
+    assert len(set(keys)) == RECORDS
+
+
+def test_linear_checkpoint_is_resumed_instead_of_split(server, make_extractor, tmp_path):
+    output_dir, checkpoints = tmp_path / "output", CheckpointStore(tmp_path / "checkpoints")
+    extractor = make_extractor()
+    crash_after(extractor, 2)
+    try:
+        extractor.save_all_pages_to_json(output_dir, checkpoints=checkpoints)
+    except RuntimeError:
+        pass
+    assert checkpoints.in_progress(LOGICAL_NAME)
+
+    job = make_extractor().extraction_job(output_dir, checkpoints=checkpoints)
+    assert job.split(4) is None
+    job.run()
+
+    assert checkpoints.is_complete(LOGICAL_NAME)
+    assert_saved_once(output_dir, server)
+
+
+def test_split_replaces_earlier_linear_pages(server, make_extractor, tmp_path):
+    output_dir, checkpoints = tmp_path / "output", CheckpointStore(tmp_path / "checkpoints")
+    extractor = make_extractor()
+    crash_after(extractor, 2)
+    try:
+        extractor.save_all_pages_to_json(output_dir, checkpoints=checkpoints)
+    except RuntimeError:
+        pass
+    # The checkpoint is gone, e.g. it failed its checksum, but the linear pages are still on disk.
+    checkpoints.reset(LOGICAL_NAME)
+
+    jobs = make_extractor().extraction_job(output_dir, checkpoints=checkpoints).split(3)
+    assert len(jobs) == 3
+    for job in jobs:
+        job.run()
+
+    assert checkpoints.is_complete(LOGICAL_NAME)
+    assert not list((output_dir / LOGICAL_NAME).glob(f"{LOGICAL_NAME}_extract_page_*.json"))
+    assert_saved_once(output_dir, server)
+
+
+def test_linear_run_replaces_earlier_partition_pages(server, make_extractor, tmp_path):
+    output_dir, checkpoints = tmp_path / "output", CheckpointStore(tmp_path / "checkpoints")
+    jobs = make_extractor().extraction_job(output_dir, checkpoints=checkpoints).split(3)
+    jobs[0].run()
+    assert not checkpoints.is_complete(LOGICAL_NAME)
+
+    make_extractor().extraction_job(output_dir, checkpoints=checkpoints).run()
+
+    assert checkpoints.is_complete(LOGICAL_NAME)
+    assert not list((output_dir / LOGICAL_NAME).glob(f"{LOGICAL_NAME}_extract_partition_*.json"))
+    assert_saved_once(output_dir, server)